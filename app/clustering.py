@@ -0,0 +1,127 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Zoom levels from which mates are shown per station, then one by one
+STATION_ZOOM = 13
+POINTS_ZOOM = 16
+# Grid cells per map tile side: a cell is a few dozen pixels wide on screen
+CELLS_PER_TILE = 8
+# Size of the map in pixels, as drawn by main.py. Map tiles are 512 pixels wide
+MAP_WIDTH = 700
+MAP_HEIGHT = 450
+TILE_SIZE = 512
+
+
+def _aggregate(ids: np.ndarray, lat: np.ndarray, lon: np.ndarray) -> pd.DataFrame:
+    """Centroid, count and first row of each group of ids."""
+    _, inverse, counts = np.unique(ids, return_inverse=True, return_counts=True)
+    first = np.full(len(counts), len(ids))
+    np.minimum.at(first, inverse, np.arange(len(ids)))
+    return pd.DataFrame(
+        {
+            "lat": np.bincount(inverse, weights=lat) / counts,
+            "lon": np.bincount(inverse, weights=lon) / counts,
+            "count": counts,
+            "first": first,
+        }
+    )
+
+
+class ClusterPyramid:
+    """Mates aggregated for every zoom level of the map.
+
+    Below STATION_ZOOM, mates are grouped in grid cells that halve in size at
+    each zoom level. Up to POINTS_ZOOM they are grouped per station, and past
+    it they are shown one by one. Only what is in view is returned, and never
+    more than max_points markers, so the map payload stays bounded.
+    """
+
+    def __init__(self, lat, lon, names, location_names):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.names = list(names)
+        self.location_names = list(location_names)
+        self.levels = []
+        if len(self.lat) == 0:
+            # Labels can't be built from empty columns with every pandas version
+            empty = pd.DataFrame(
+                {"lat": [], "lon": [], "count": [], "first": [], "label": []}
+            ).astype({"count": np.int64, "first": np.int64, "label": object})
+            self.levels = [empty] * STATION_ZOOM
+            self.stations = self.points = empty
+            return
+        for zoom in range(STATION_ZOOM):
+            size = 360 / (2**zoom * CELLS_PER_TILE)
+            i = np.floor((self.lat + 90) / size).astype(np.int64)
+            j = np.floor((self.lon + 180) / size).astype(np.int64)
+            level = _aggregate(i * (2**zoom * CELLS_PER_TILE + 1) + j, self.lat, self.lon)
+            self.levels.append(self._label(level, ""))
+        _, station_ids = np.unique(self.location_names, return_inverse=True)
+        stations = _aggregate(station_ids, self.lat, self.lon)
+        self.stations = self._label(
+            stations, np.asarray(self.location_names, dtype=object)[stations["first"]] + ": "
+        )
+        self.points = pd.DataFrame(
+            {
+                "lat": self.lat,
+                "lon": self.lon,
+                "count": 1,
+                "first": np.arange(len(self.lat)),
+                "label": self.names,
+            }
+        )
+
+    @classmethod
+    def from_mates(cls, mates: Iterable[Dict]):
+        mates = list(mates)
+        return cls(
+            [m["lat"] for m in mates],
+            [m["lon"] for m in mates],
+            [m["name"] for m in mates],
+            [m["location_name"] for m in mates],
+        )
+
+    def busiest_location(self) -> Optional[str]:
+        """The station where most mates live, if there are any mates."""
+        if len(self.stations) == 0:
+            return None
+        return self.location_names[self.stations["first"][self.stations["count"].idxmax()]]
+
+    def _label(self, clusters: pd.DataFrame, prefix) -> pd.DataFrame:
+        """Name single mates, and count the others."""
+        names = np.asarray(self.names, dtype=object)[clusters["first"]]
+        counts = prefix + clusters["count"].astype(str) + " mates"
+        clusters["label"] = np.where(clusters["count"] == 1, names, counts)
+        return clusters
+
+    def clusters(
+        self, zoom: float, center: Optional[Dict[str, float]] = None, max_points: int = 1000
+    ) -> Tuple[pd.DataFrame, int]:
+        """Markers to draw at this zoom level, in a map around center if given,
+        and the zoom level they are for.
+
+        When there is nothing in view at this level, or too much, markers of
+        coarser levels are returned. The map should then be drawn at that
+        level, so that it shows them.
+        """
+        zoom = int(max(zoom, 0))
+        if zoom >= POINTS_ZOOM:
+            clusters = self.points
+        elif zoom >= STATION_ZOOM:
+            clusters = self.stations
+        else:
+            clusters = self.levels[zoom]
+        if center is not None:
+            degrees_per_pixel = 360 / (TILE_SIZE * 2**zoom)
+            # Meridians are drawn further apart than parallels, away from the equator
+            half_height = MAP_HEIGHT / 2 * degrees_per_pixel * np.cos(np.radians(center["lat"]))
+            half_width = MAP_WIDTH / 2 * degrees_per_pixel
+            clusters = clusters[
+                (np.abs(clusters["lat"] - center["lat"]) <= half_height)
+                & (np.abs((clusters["lon"] - center["lon"] + 180) % 360 - 180) <= half_width)
+            ]
+        if (len(clusters) > max_points or len(clusters) == 0) and zoom > 0:
+            return self.clusters(zoom - 1, center, max_points)
+        return clusters, zoom
@@ -0,0 +1,262 @@
+"""Compute the nearest mates of every mate, for the periodic digest.
+
+Run from the root of the repo:
+
+    python app/digest.py --storage sqlite --output digest.jsonl
+    python app/digest.py --deta-key ... --output digest.parquet --check 100
+
+Mates are split in spatial tiles, and tiles are processed by a pool of
+workers. Each task only holds the mates of its tile and of a halo around it,
+and mates whose nearest mates may lie past the halo are processed again with
+a larger one. Results are streamed to disk tile by tile, as JSON lines or
+Parquet if the optional pyarrow is installed. Each user gets the same mates as find_mates would
+return, including themselves unless --exclude-self is set.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from distance import EARTH_RADIUS_KM, distances
+from functions import find_mates
+from spatial_index import GridIndex
+from storage import get_storage
+
+# Each task starts with a halo of this many tiles, grown fourfold for the
+# mates whose nearest mates may lie beyond it
+HALO_TILES = 1
+
+
+def _distance_to_outside(lat, lon, box) -> np.ndarray:
+    """Smallest distance in km from (lat, lon) to a point outside the box.
+
+    box is (min_lat, max_lat, center_lon, half_width) in degrees. A point
+    outside is further in latitude, or past one of the meridians on the side,
+    and then past the great circle they are part of.
+    """
+    min_lat, max_lat, center_lon, half_width = box
+    along_meridian = np.minimum(
+        np.where(min_lat > -90, lat - min_lat, np.inf),
+        np.where(max_lat < 90, max_lat - lat, np.inf),
+    )
+    if half_width >= 180:
+        return EARTH_RADIUS_KM * np.radians(along_meridian)
+    d_lon = half_width - np.abs((lon - center_lon + 180) % 360 - 180)
+    across_meridian = np.arcsin(
+        np.cos(np.radians(lat)) * np.sin(np.radians(np.minimum(d_lon, 90)))
+    )
+    return EARTH_RADIUS_KM * np.minimum(np.radians(along_meridian), across_meridian)
+
+
+def _nearest_in_tile(task: Dict) -> Tuple[List[Dict], np.ndarray]:
+    """Nearest mates of the rows of a task, among the mates around them.
+
+    Return the records of the rows whose nearest mates are all in the halo,
+    and the other rows, to run again with a larger halo.
+    """
+    k, exclude_self = task["k"], task["exclude_self"]
+    lat, lon = task["lat"], task["lon"]
+    index = GridIndex()
+    for i in range(len(lat)):
+        index.put(i, lat[i], lon[i])
+    outside = _distance_to_outside(lat[task["local_rows"]], lon[task["local_rows"]], task["box"])
+    results, unresolved = [], []
+    for row, i, limit in zip(task["rows"], task["local_rows"], outside):
+        nearest = index.nearest(lat[i], lon[i], k + exclude_self)
+        complete = len(nearest) == k + exclude_self and nearest[-1][1] <= limit
+        if not (complete or task["everyone"]):
+            unresolved.append(row)
+            continue
+        nearest = [j for j, _ in nearest if not (exclude_self and j == i)][:k]
+        mates_distances = distances(lat[i], lon[i], lat[nearest], lon[nearest], method="vincenty")
+        results.append(
+            {
+                "key": task["keys"][i],
+                "mates": [
+                    {
+                        "key": task["keys"][j],
+                        "name": task["names"][j],
+                        "location_name": task["location_names"][j],
+                        "distance (km)": float(distance),
+                    }
+                    for j, distance in zip(nearest, mates_distances)
+                ],
+            }
+        )
+    return results, np.array(unresolved, dtype=np.int64)
+
+
+class Population:
+    """Every mate, sorted by latitude to cut tasks out of it quickly."""
+
+    def __init__(self, keys: List[str], names: List[str], location_names: List[str], lat, lon):
+        self.keys = keys
+        self.names = names
+        self.location_names = location_names
+        self.lat = lat
+        self.lon = lon
+        self.by_lat = np.argsort(lat, kind="stable")
+        self.sorted_lat = lat[self.by_lat]
+
+    def task(self, rows: np.ndarray, halo: float, k: int, exclude_self: bool) -> Dict:
+        """Rows of a tile, and the mates at most halo degrees away from the tile."""
+        min_lat, max_lat = self.lat[rows].min() - halo, self.lat[rows].max() + halo
+        # Tiles never cross the antimeridian, but their halo may
+        center_lon = (self.lon[rows].min() + self.lon[rows].max()) / 2
+        half_width = self.lon[rows].max() - center_lon + halo
+        start = np.searchsorted(self.sorted_lat, min_lat, side="left")
+        stop = np.searchsorted(self.sorted_lat, max_lat, side="right")
+        band = self.by_lat[start:stop]
+        if half_width < 180:
+            band = band[np.abs((self.lon[band] - center_lon + 180) % 360 - 180) <= half_width]
+        band = np.union1d(band, rows)
+        return {
+            "rows": rows,
+            "local_rows": np.searchsorted(band, rows),
+            "lat": self.lat[band],
+            "lon": self.lon[band],
+            "keys": [self.keys[i] for i in band],
+            "names": [self.names[i] for i in band],
+            "location_names": [self.location_names[i] for i in band],
+            "box": (min_lat, max_lat, center_lon, half_width),
+            "everyone": len(band) == len(self.keys),
+            "k": k,
+            "exclude_self": int(exclude_self),
+        }
+
+
+def tiles(
+    lat: np.ndarray, lon: np.ndarray, tile_size: float, max_rows: int
+) -> Iterator[np.ndarray]:
+    """Rows grouped by spatial tile, in chunks of at most max_rows."""
+    tile_ids = np.floor(lat / tile_size) * 1e6 + np.floor(lon / tile_size)
+    _, inverse = np.unique(tile_ids, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.flatnonzero(np.diff(inverse[order])) + 1
+    for tile in np.split(order, bounds):
+        for start in range(0, len(tile), max_rows):
+            yield tile[start : start + max_rows]
+
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        self.f = open(path, "w", encoding="utf-8")
+
+    def write(self, records: List[Dict]):
+        for record in records:
+            self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetWriter:
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        mate = pa.struct(
+            [(field, pa.string()) for field in ["key", "name", "location_name"]]
+            + [("distance (km)", pa.float64())]
+        )
+        # Given rather than inferred, as tiles may have no records
+        self.schema = pa.schema([("key", pa.string()), ("mates", pa.list_(mate))])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, records: List[Dict]):
+        import pyarrow as pa
+
+        self.writer.write_table(pa.Table.from_pylist(records, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def check(storage, lat, lon, keys, digest_path: str, n: int, exclude_self: bool) -> List[str]:
+    """Compare the digest of n random mates with find_mates. Return mismatches."""
+    if digest_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        digest = {r["key"]: r["mates"] for r in pq.read_table(digest_path).to_pylist()}
+    else:
+        with open(digest_path, encoding="utf-8") as f:
+            digest = {r["key"]: r["mates"] for r in map(json.loads, f)}
+    mismatches = []
+    rng = np.random.default_rng(0)
+    for row in rng.choice(len(keys), min(n, len(keys)), replace=False):
+        got = digest[keys[row]]
+        expected = find_mates(storage, {"lat": lat[row], "lon": lon[row]}, len(got) + exclude_self)
+        if exclude_self:
+            expected = expected[expected["key"] != keys[row]].head(len(got))
+        # Mates at the same distance may come in any order
+        if not np.allclose(
+            sorted(m["distance (km)"] for m in got), np.sort(expected["distance (km)"])
+        ):
+            mismatches.append(keys[row])
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--storage", choices=["deta", "sqlite"], default="deta")
+    parser.add_argument("--deta-key", default=os.environ.get("DETA_KEY"))
+    parser.add_argument("--sqlite-path", default="mates.db")
+    parser.add_argument(
+        "--output", default="digest.jsonl", help=".jsonl, or .parquet if pyarrow is installed"
+    )
+    parser.add_argument("-k", type=int, default=6, help="Mates per user, as in find_mates")
+    parser.add_argument("--exclude-self", action="store_true")
+    parser.add_argument("--tile-size", type=float, default=0.1, help="In degrees")
+    parser.add_argument("--max-rows", type=int, default=5000, help="Per task")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--check", type=int, default=0, help="Compare n users with find_mates")
+    args = parser.parse_args()
+
+    storage = get_storage(
+        {"storage": args.storage, "deta_key": args.deta_key, "sqlite_path": args.sqlite_path}
+    )
+    keys, names, location_names, lat, lon = [], [], [], [], []
+    for mate in storage.fetch_all():
+        keys.append(mate["key"])
+        names.append(mate["name"])
+        location_names.append(mate["location_name"])
+        lat.append(mate["lat"])
+        lon.append(mate["lon"])
+    lat, lon = np.array(lat, dtype=np.float64), np.array(lon, dtype=np.float64)
+    population = Population(keys, names, location_names, lat, lon)
+
+    if args.output.endswith(".parquet"):
+        writer = ParquetWriter(args.output)
+    else:
+        writer = JsonlWriter(args.output)
+    rows = np.arange(len(keys))
+    halo = HALO_TILES * args.tile_size
+    with multiprocessing.Pool(args.processes) as pool:
+        while len(rows):
+            tasks = (
+                population.task(rows[tile], halo, args.k, args.exclude_self)
+                for tile in tiles(lat[rows], lon[rows], args.tile_size, args.max_rows)
+            )
+            unresolved = []
+            for results, tile_unresolved in pool.imap_unordered(_nearest_in_tile, tasks):
+                writer.write(results)
+                unresolved.append(tile_unresolved)
+            rows = np.concatenate(unresolved) if unresolved else rows[:0]
+            halo *= 4
+    writer.close()
+    print(f"Wrote the nearest mates of {len(keys)} mates to {args.output}")
+
+    if args.check:
+        mismatches = check(storage, lat, lon, keys, args.output, args.check, args.exclude_self)
+        if mismatches:
+            print(f"{len(mismatches)} mates differ from find_mates: {mismatches[:10]}")
+            sys.exit(1)
+        print(f"Checked {min(args.check, len(keys))} mates against find_mates")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+from typing import Iterator, Tuple
+
+import numpy as np
+
+# Mean earth radius, used by the spherical (haversine) model
+EARTH_RADIUS_KM = 6371.0088
+
+# WGS-84 ellipsoid, used by the ellipsoidal (Vincenty) model
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B_KM = WGS84_A_KM * (1 - WGS84_F)
+
+
+def _haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in km on a sphere. Inputs are broadcast together."""
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2)
+    )
+    h = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def _vincenty(lat1, lon1, lat2, lon2, tol: float = 1e-12, max_iter: int = 200) -> np.ndarray:
+    """Geodesic distance in km on the WGS-84 ellipsoid. Inputs are broadcast together.
+
+    This is Vincenty's inverse formula, which agrees with geopy's geodesic to
+    well under a millimeter. It does not converge for nearly antipodal points,
+    which are solved one by one with Karney's algorithm from geographiclib.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+    )
+    f = WGS84_F
+    L = lon2 - lon1
+    U1 = np.arctan((1 - f) * np.tan(lat1))
+    U2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt(
+                (cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2
+            )
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha**2
+            # cos2_alpha is 0 on the equator
+            cos_2sigma_m = np.where(
+                cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha
+            )
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma
+                + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m**2))
+            )
+            # lambda leaving [-pi, pi] means the iteration is going astray
+            converged = (np.abs(lam - lam_prev) < tol) & (np.abs(lam) <= np.pi)
+            if converged.all():
+                break
+
+    u2 = cos2_alpha * (WGS84_A_KM**2 - WGS84_B_KM**2) / WGS84_B_KM**2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = (
+        B
+        * sin_sigma
+        * (
+            cos_2sigma_m
+            + B
+            / 4
+            * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+                - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)
+            )
+        )
+    )
+    s = np.array(WGS84_B_KM * A * (sigma - delta_sigma))
+    if not converged.all():
+        from geographiclib.geodesic import Geodesic
+
+        points = [np.degrees(x).ravel() for x in (lat1, lon1, lat2, lon2)]
+        for i in np.flatnonzero(~converged):
+            s.flat[i] = Geodesic.WGS84.Inverse(*(x[i] for x in points))["s12"] / 1000
+    return s
+
+
+METHODS = {"haversine": _haversine, "vincenty": _vincenty}
+
+
+def distances(lat: float, lon: float, lats, lons, method: str = "haversine") -> np.ndarray:
+    """Distances in km from one origin to an array of points, in a single call."""
+    return METHODS[method](lat, lon, lats, lons)
+
+
+def iter_pairwise(
+    lats1, lons1, lats2, lons2, method: str = "haversine", max_bytes: int = 64 * 2**20
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """Yield (start, stop, block) where block holds the distances in km from
+    points start:stop of the first array to every point of the second one.
+
+    Blocks are sized so that temporaries stay under about max_bytes.
+    """
+    lats1, lons1 = np.asarray(lats1), np.asarray(lons1)
+    lats2, lons2 = np.asarray(lats2), np.asarray(lons2)
+    # The Vincenty iteration keeps around 20 float64 temporaries per pair
+    bytes_per_row = max(len(lats2), 1) * 8 * (20 if method == "vincenty" else 6)
+    rows = max(1, max_bytes // bytes_per_row)
+    for start in range(0, len(lats1), rows):
+        stop = min(start + rows, len(lats1))
+        block = METHODS[method](
+            lats1[start:stop, None], lons1[start:stop, None], lats2[None, :], lons2[None, :]
+        )
+        yield start, stop, block
+
+
+def pairwise(
+    lats1, lons1, lats2=None, lons2=None, method: str = "haversine", max_bytes: int = 64 * 2**20
+) -> np.ndarray:
+    """Full matrix of distances in km, computed in chunks of bounded memory."""
+    if lats2 is None:
+        lats2, lons2 = lats1, lons1
+    result = np.empty((len(lats1), len(lats2)))
+    for start, stop, block in iter_pairwise(lats1, lons1, lats2, lons2, method, max_bytes):
+        result[start:stop] = block
+    return result
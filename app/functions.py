@@ -1,4 +1,49 @@
+from typing import Dict
+
 import numpy as np
+import pandas as pd
+
+from distance import distances
+from storage import MATE_FIELDS
+
+
+def find_mates(
+    mates,
+    coords: Dict[str, float],
+    min_mates=6,
+) -> pd.DataFrame:
+    """Find mates that indicated a location near coords.
+
+    `mates` is a MatesStorage or a MatesCache.
+    """
+    # Select the closest mates, ranked by great-circle distance
+    nearest = mates.nearest(coords["lat"], coords["lon"], min_mates)
+    all_mates_df = pd.DataFrame(nearest, columns=MATE_FIELDS)
+    # Compute proper geodesic distance for them
+    all_mates_df["distance (km)"] = distances(
+        coords["lat"],
+        coords["lon"],
+        all_mates_df["lat"].to_numpy(),
+        all_mates_df["lon"].to_numpy(),
+        method="vincenty",
+    )
+    return all_mates_df
+
+
+def add_own_mate(
+    mates_df: pd.DataFrame,
+    mate: Dict,
+    min_mates=6,
+) -> pd.DataFrame:
+    """Merge a mate in search results that may have been computed before
+    their own write landed, replacing any older record of theirs."""
+    own_df = pd.DataFrame([mate])
+    # The mate searched from their own location
+    own_df["distance (km)"] = 0.0
+    all_mates_df = pd.concat(
+        [own_df, mates_df[mates_df["key"] != mate["key"]]], ignore_index=True
+    )
+    return all_mates_df.nsmallest(min_mates, "distance (km)", keep="first")
 
 
 def get_plotting_zoom_level_and_center_coordinates_from_lonlat_tuples(
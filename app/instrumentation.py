@@ -0,0 +1,87 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, List
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class StageTimer:
+    """Latency histogram of each stage of a search, shared by all sessions.
+
+    Histograms can be exported in the Prometheus text format, or as JSON.
+    """
+
+    def __init__(self, name: str = "meet_mates_stage_seconds", buckets=BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            counts = self._counts.setdefault(stage, [0] * (len(self.buckets) + 1))
+            # The last count is for the +Inf bucket
+            i = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), -1)
+            counts[i] += 1
+            self._sums[stage] = self._sums.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Time the body of a with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str, f: Callable) -> Callable:
+        """Wrap f so that each call is timed, e.g. to run it in another thread."""
+
+        def wrapper(*args, **kwargs):
+            with self.stage(stage):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    def to_json(self) -> Dict[str, Dict]:
+        """Cumulative bucket counts, sum and count of each stage."""
+        with self._lock:
+            stages = {}
+            for stage, counts in self._counts.items():
+                cumulative, total = {}, 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+                    total += count
+                    cumulative[str(bound)] = total
+                stages[stage] = {"buckets": cumulative, "sum": self._sums[stage], "count": total}
+            return stages
+
+    def to_prometheus(self) -> str:
+        lines = [
+            f"# HELP {self.name} Latency of each stage of a search.",
+            f"# TYPE {self.name} histogram",
+        ]
+        for stage, histogram in self.to_json().items():
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{self.name}_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'{self.name}_count{{stage="{stage}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """Write the histograms to path, as JSON if it ends with .json.
+
+        The file is replaced atomically, so a scraper never reads half of it.
+        """
+        if path.endswith(".json"):
+            content = json.dumps(self.to_json(), indent=2)
+        else:
+            content = self.to_prometheus()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
@@ -1,61 +1,64 @@
+import time
 import streamlit as st
-import pandas as pd
 import numpy as np
-from deta import Deta
-from typing import List, Dict
-from geopy.distance import geodesic
+from typing import Dict
 import plotly.express as px
-from functions import get_plotting_zoom_level_and_center_coordinates_from_lonlat_tuples
+from concurrent.futures import ThreadPoolExecutor
+from functions import (
+    add_own_mate,
+    find_mates,
+    get_plotting_zoom_level_and_center_coordinates_from_lonlat_tuples,
+)
+from instrumentation import StageTimer
+from clustering import MAP_HEIGHT, MAP_WIDTH, POINTS_ZOOM, ClusterPyramid
+from mates_cache import MatesCache
+from stations import StationIndex
+from storage import get_storage
+
+
+# Load data
+@st.cache(allow_output_mutation=True)
+def load_stations():
+    return StationIndex.load()
+
+
+stations = load_stations()
+
 
 # Load database
-deta = Deta(st.secrets["deta_key"])
-db = deta.Base("mates")
+@st.cache(allow_output_mutation=True)
+def load_mates():
+    """Shared by every session of this process.
 
+    Storages that can't search mates by position are wrapped in a cache.
+    """
+    storage = get_storage(st.secrets)
+    if storage.native_spatial_queries:
+        return storage
+    return MatesCache(storage, ttl=st.secrets.get("mates_cache_ttl", 300))
 
-# Load data
-@st.cache()
-def load_stops():
-    stops = pd.read_csv("data_gathering/output_data/slim_stops.csv")
-    return stops
+
+@st.cache(allow_output_mutation=True)
+def load_executor():
+    """Threads running the write and the search of a submission side by side."""
+    return ThreadPoolExecutor(max_workers=8)
+
+
+@st.cache(allow_output_mutation=True)
+def load_timer():
+    """Latency of each stage, dumped to the metrics_path secret after each search."""
+    return StageTimer()
 
 
-stops = load_stops()
+@st.cache(allow_output_mutation=True, ttl=60)
+def load_cluster_pyramid():
+    """Mates aggregated for every zoom level, rebuilt every minute."""
+    return ClusterPyramid.from_mates(load_mates().fetch_all())
 
 
 def get_coords(location_name: str) -> Dict[str, float]:
     """Find associated coordinates to a location name."""
-    stop = stops[stops["stop_name"] == location_name]
-    return {"lon": stop["stop_lon"].iloc[0], "lat": stop["stop_lat"].iloc[0]}
-
-
-def find_mates(
-    my_name: str,
-    coords: Dict[str, float],
-    min_mates=6,
-) -> pd.DataFrame:
-    """Find mates that indicated a location near coords."""
-    coords_vec = np.array([coords["lat"], coords["lon"]])
-    all_mates = db.fetch().items
-    all_mates_df = pd.DataFrame(all_mates)
-    # all_mates_df = all_mates_df[all_mates_df["name"] != my_name]
-    mates_position = np.array(all_mates_df[["lat", "lon"]])
-    # Compute L1 distance to every other mate
-    # We can do that because every point is very close (approximately a plane)
-    # Compute a proper geodesic otherwise.
-    mates_distances = np.linalg.norm((mates_position - coords_vec), ord=1, axis=1)
-    # Select all top 5 closest mates
-    n = min(min_mates, all_mates_df.shape[0])
-    min_indices = np.argpartition(mates_distances, n - 1)[:n]
-    all_mates_df = all_mates_df.iloc[min_indices]
-    # Compute proper meter distance for them
-    all_mates_df["distance (km)"] = all_mates_df.apply(
-        lambda x: geodesic(
-            (x["lat"], x["lon"]),
-            (coords["lat"], coords["lon"]),
-        ).km,
-        axis=1,
-    )
-    return all_mates_df
+    return stations.coords(location_name)
 
 
 # Page
@@ -77,7 +80,7 @@ with st.form("form"):
     )
     location_name = st.selectbox(
         "Public transport station close to your home",
-        options=stops["stop_name"],
+        options=stations.names,
         help="Start typing to quickly find your station",
     )
     submitted = st.form_submit_button("Search mates")
@@ -89,40 +92,93 @@ if submitted and name.strip() == "":
     st.warning("Please enter your name!")
 
 if submitted and name.strip() != "":
-    coords = get_coords(location_name)
+    timer = load_timer()
+    start = time.perf_counter()
+    with timer.stage("get_coords"):
+        coords = get_coords(location_name)
     # Push data to database
     # Mates are uniquely identified by their names. This allows impersonation, but the damages here are limited.
-    db.put(
-        {
-            "name": name,
-            "location_name": location_name,
-            "lon": coords["lon"],
-            "lat": coords["lat"],
-        },
-        key=name,
-    )
-    mates = find_mates(name, coords)
+    mate = {
+        "name": name,
+        "location_name": location_name,
+        "lon": coords["lon"],
+        "lat": coords["lat"],
+    }
+    # The write and the search don't depend on each other, so they run at the
+    # same time. The search may miss the write: the mate is then merged locally
+    mates_source = load_mates()
+    put = load_executor().submit(timer.timed("put", mates_source.put), mate, key=name)
+    search = load_executor().submit(timer.timed("find_mates", find_mates), mates_source, coords)
+    mates = add_own_mate(search.result(), {**mate, "key": name})
+    put.result()
+    # Center the map of all the mates on the new mate
+    st.session_state["map_location_name"] = location_name
     st.markdown("## These mates live near you:")
-    # Show a table with mates
-    st.table(mates[mates["name"] != mates][["name", "location_name", "distance (km)"]])
-    # Plot a map
-    zoom, center = get_plotting_zoom_level_and_center_coordinates_from_lonlat_tuples(
-        mates["lon"], mates["lat"]
-    )
-    fig = px.scatter_mapbox(
-        mates,
-        lat="lat",
-        lon="lon",
-        hover_name="name",
-        hover_data=["location_name"],
-        color_discrete_sequence=["black"],
-        size=[6 for i in range(mates.shape[0])],
-        zoom=zoom,
-        center={"lat": center[1], "lon": center[0]},
+    with timer.stage("table"):
+        # Show a table with mates
+        st.table(mates[mates["name"] != mates][["name", "location_name", "distance (km)"]])
+    with timer.stage("map"):
+        # Plot a map
+        zoom, center = get_plotting_zoom_level_and_center_coordinates_from_lonlat_tuples(
+            mates["lon"], mates["lat"]
+        )
+        fig = px.scatter_mapbox(
+            mates,
+            lat="lat",
+            lon="lon",
+            hover_name="name",
+            hover_data=["location_name"],
+            color_discrete_sequence=["black"],
+            size=np.full(mates.shape[0], 6),
+            zoom=zoom,
+            center={"lat": center[1], "lon": center[0]},
+        )
+        fig.update_layout(mapbox_style="open-street-map")
+        fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+        st.plotly_chart(fig)
+    timer.observe("total", time.perf_counter() - start)
+    timer.dump(st.secrets.get("metrics_path", "metrics.prom"))
+
+# Only clusters of mates are sent to the browser, so this map stays light
+# however many mates there are
+if st.checkbox("Show all the mates on a map"):
+    pyramid = load_cluster_pyramid()
+    map_zoom = st.slider(
+        "Zoom in to see stations, then mates", min_value=0, max_value=POINTS_ZOOM, value=10
     )
-    fig.update_layout(mapbox_style="open-street-map")
-    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
-    st.plotly_chart(fig)
+    if len(pyramid.lat) > 0:
+        # The map can't be panned from Python, so pick where to look at
+        if "map_location_name" not in st.session_state:
+            busiest = pyramid.busiest_location()
+            st.session_state["map_location_name"] = (
+                busiest if busiest in stations.ids else stations.names[0]
+            )
+        map_location_name = st.selectbox(
+            "Center the map on", options=stations.names, key="map_location_name"
+        )
+        map_center = get_coords(map_location_name)
+        # Zoomed out if nothing is in view, or too many markers
+        clusters, clusters_zoom = pyramid.clusters(map_zoom, center=map_center)
+        if clusters_zoom < map_zoom:
+            st.caption(
+                f"Zoomed out to {clusters_zoom} to show the mates around {map_location_name}"
+            )
+        fig = px.scatter_mapbox(
+            clusters,
+            lat="lat",
+            lon="lon",
+            hover_name="label",
+            color_discrete_sequence=["black"],
+            size="count",
+            size_max=30,
+            zoom=clusters_zoom,
+            center=map_center,
+            width=MAP_WIDTH,
+            height=MAP_HEIGHT,
+        )
+        fig.update_layout(mapbox_style="open-street-map")
+        fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+        st.plotly_chart(fig)
 
 st.markdown(
     """---
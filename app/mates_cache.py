@@ -0,0 +1,219 @@
+import sys
+import threading
+import time
+import warnings
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from spatial_index import GridIndex
+from storage import MatesStorage
+
+
+class MatesCache:
+    """Process-wide copy of the mates table, kept current by write-through.
+
+    The whole table is read once, then every put goes both to the storage and
+    to the cache. The cache is reloaded when it is older than `ttl` seconds
+    or when `invalidate` was called, to pick up writes from other processes.
+    Reloads build new columns on the side: other sessions keep reading the
+    current ones meanwhile, except on the first load. Both copies are in
+    memory until the new one is swapped in.
+
+    Columns are stored as compact arrays: float32 lat/lon and interned strings.
+    The grid index reads positions from them, and only adds a few bytes per mate.
+    At most `max_mates` mates are kept in memory. Past that, the cache can't
+    answer searches and reads go to the storage until a reload fits again.
+    """
+
+    def __init__(self, storage: MatesStorage, ttl: float = 300, max_mates: int = 1_000_000):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_mates = max_mates
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.storage_reads = 0
+        self._lock = threading.RLock()
+        # Held by the thread reading the whole table
+        self._refresh_lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        self._loaded_version = -1
+        # Mates put during a reload, that the reload may have missed
+        self._pending: Optional[Dict[str, Dict]] = None
+        self._clear()
+
+    def _clear(self, capacity: int = 1024):
+        # Whether every mate of the storage fits in the cache
+        self.complete = True
+        self.keys: List[str] = []
+        self.names: List[str] = []
+        self.location_names: List[str] = []
+        self.lat = np.empty(capacity, dtype=np.float32)
+        self.lon = np.empty(capacity, dtype=np.float32)
+        self.rows: Dict[str, int] = {}
+        # The index reads positions from the columns above
+        self.index = GridIndex()
+        self.index.attach(self.lat, self.lon)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _store(self, key: str, mate: Dict):
+        """Insert or update a mate in the cached columns."""
+        row = self.rows.get(key)
+        if row is None:
+            if len(self.keys) >= self.max_mates:
+                self.complete = False
+                return
+            row = len(self.keys)
+            if row == len(self.lat):
+                capacity = min(2 * len(self.lat), self.max_mates)
+                self.lat = np.resize(self.lat, capacity)
+                self.lon = np.resize(self.lon, capacity)
+                self.index.attach(self.lat, self.lon)
+            self.keys.append(sys.intern(key))
+            self.names.append("")
+            self.location_names.append("")
+            self.rows[key] = row
+        self.names[row] = sys.intern(mate["name"])
+        self.location_names[row] = sys.intern(mate["location_name"])
+        self.lat[row] = mate["lat"]
+        self.lon[row] = mate["lon"]
+        self.index.put(row, self.lat[row], self.lon[row])
+
+    def _warn_full(self):
+        warnings.warn(
+            f"Mates cache is full ({self.max_mates} mates), reading from the storage instead"
+        )
+
+    def _record(self, row: int) -> Dict:
+        return {
+            "key": self.keys[row],
+            "name": self.names[row],
+            "location_name": self.location_names[row],
+            "lat": float(self.lat[row]),
+            "lon": float(self.lon[row]),
+        }
+
+    def refresh(self):
+        """Read the whole mates table and swap it in for the cached columns."""
+        with self._refresh_lock:
+            self._reload()
+
+    def _reload(self):
+        with self._lock:
+            version = self.version
+            self._pending = {}
+        # The table is read without holding the lock, into another cache
+        fresh = MatesCache(self.storage, max_mates=self.max_mates)
+        for mate in self.storage.fetch_all():
+            fresh._store(mate["key"], mate)
+        fresh.index.rebuild()
+        with self._lock:
+            for key, mate in self._pending.items():
+                fresh._store(key, mate)
+            self._pending = None
+            if self.complete and not fresh.complete:
+                self._warn_full()
+            self.complete = fresh.complete
+            self.keys, self.names, self.location_names = (
+                fresh.keys,
+                fresh.names,
+                fresh.location_names,
+            )
+            self.lat, self.lon, self.rows, self.index = (
+                fresh.lat,
+                fresh.lon,
+                fresh.rows,
+                fresh.index,
+            )
+            self._loaded_at = time.monotonic()
+            self._loaded_version = version
+            self.refreshes += 1
+
+    def invalidate(self):
+        """Force a reload on the next read."""
+        with self._lock:
+            self.version += 1
+
+    def _is_stale(self) -> bool:
+        return (
+            self._loaded_at is None
+            or self._loaded_version != self.version
+            or time.monotonic() - self._loaded_at > self.ttl
+        )
+
+    def _ensure_fresh(self) -> bool:
+        """Reload the cache if needed. Return whether it can answer reads."""
+        with self._lock:
+            stale = self._is_stale()
+            if stale:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if stale:
+            if self._loaded_at is None:
+                # Nothing to serve yet: wait for the first load
+                with self._refresh_lock:
+                    if self._is_stale():
+                        self._reload()
+            elif self._refresh_lock.acquire(blocking=False):
+                # Another thread may be reloading already, then keep serving
+                # the current columns until it is done
+                try:
+                    self._reload()
+                finally:
+                    self._refresh_lock.release()
+        with self._lock:
+            if not self.complete:
+                self.storage_reads += 1
+            return self.complete
+
+    def put(self, mate: Dict, key: str):
+        """Write a mate to the storage, then to the cache."""
+        self.storage.put(mate, key=key)
+        with self._lock:
+            if self._pending is not None:
+                self._pending[key] = mate
+            complete = self.complete
+            self._store(key, mate)
+            if complete and not self.complete:
+                self._warn_full()
+
+    def get(self, key: str) -> Optional[Dict]:
+        if not self._ensure_fresh():
+            return self.storage.get(key)
+        with self._lock:
+            row = self.rows.get(key)
+            return None if row is None else self._record(row)
+
+    def fetch_all(self) -> List[Dict]:
+        if not self._ensure_fresh():
+            return list(self.storage.fetch_all())
+        with self._lock:
+            return [self._record(row) for row in range(len(self.keys))]
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Dict]:
+        """Return the k mates closest to (lat, lon), closest first."""
+        if not self._ensure_fresh():
+            return self.storage.nearest(lat, lon, k)
+        with self._lock:
+            return [self._record(row) for row, _ in self.index.nearest(lat, lon, k)]
+
+    def within(self, lat: float, lon: float, radius: float) -> List[Dict]:
+        """Return the mates closer than radius km to (lat, lon), closest first."""
+        if not self._ensure_fresh():
+            return self.storage.within(lat, lon, radius)
+        with self._lock:
+            return [self._record(row) for row, _ in self.index.within(lat, lon, radius)]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "mates": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "storage_reads": self.storage_reads,
+        }
@@ -0,0 +1,250 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from distance import EARTH_RADIUS_KM, distances
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """Concatenation of np.arange(start, stop) for each pair, without a loop."""
+    lengths = stops - starts
+    ends = np.cumsum(lengths)
+    return np.repeat(stops - ends, lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+
+class GridIndex:
+    """Geohash-like grid over (lat, lon) positions, updated incrementally.
+
+    Points are identified by integer rows, and their positions are kept in
+    NumPy arrays, which may belong to the caller (see `attach`). Rows are sorted by grid cell, with the offsets of each
+    occupied cell, and the cell size is picked from the density of points so
+    that a typical cell holds about `leaf_size` of them. Queries look at
+    squares of cells that double in size around the query point, and stop as
+    soon as no point outside can beat the current candidates. Within the
+    square, whole cells are skipped when they are too far away.
+
+    Points put since the last build are scanned apart, and the grid is rebuilt
+    once they get numerous.
+    """
+
+    def __init__(self, cell_size: Optional[float] = None, leaf_size: int = 32):
+        self.fixed_cell_size = cell_size
+        self.leaf_size = leaf_size
+        self.lat = np.empty(0)
+        self.lon = np.empty(0)
+        self._owns_positions = True
+        self._present = np.zeros(0, dtype=bool)
+        # Rows put since the last build, which the grid doesn't know or places wrong
+        self._pending = np.zeros(0, dtype=bool)
+        self._pending_rows: List[int] = []
+        self._count = 0
+        self._build(np.empty(0, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def attach(self, lat: np.ndarray, lon: np.ndarray):
+        """Read positions from these arrays instead of copies of them.
+
+        They must hold the positions of every indexed row. The owner calls
+        this again whenever it reallocates them.
+        """
+        self.lat, self.lon = lat, lon
+        self._owns_positions = False
+
+    def _grow(self, size: int):
+        capacity = max(size, 2 * len(self._present), 1024)
+        names = ["_present", "_pending"]
+        if self._owns_positions:
+            names += ["lat", "lon"]
+        for name in names:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[: len(old)] = old
+            setattr(self, name, new)
+
+    def put(self, row: int, lat: float, lon: float):
+        """Insert a point, or move it if the row is already indexed."""
+        if row >= len(self._present):
+            self._grow(row + 1)
+        if not self._present[row]:
+            self._present[row] = True
+            self._count += 1
+        self.lat[row], self.lon[row] = lat, lon
+        if not self._pending[row]:
+            self._pending[row] = True
+            self._pending_rows.append(row)
+
+    def remove(self, row: int):
+        """Remove a point from the index. Unknown rows are ignored."""
+        if row < len(self.lat) and self._present[row]:
+            self._present[row] = False
+            self._count -= 1
+
+    def _cell_size(self, rows: np.ndarray) -> float:
+        """Cell size in degrees, dividing 360 so that cells wrap around the globe."""
+        size = self.fixed_cell_size
+        if size is None:
+            size = 0.1
+            for _ in range(2):
+                if not len(rows):
+                    break
+                _, inverse, counts = np.unique(
+                    self._cell_ids(self.lat[rows], self.lon[rows], size),
+                    return_inverse=True,
+                    return_counts=True,
+                )
+                # Cells hold points in proportion to their area
+                typical = np.median(counts[inverse])
+                size = float(np.clip(size * np.sqrt(self.leaf_size / typical), 1e-4, 5))
+        return 360 / np.ceil(360 / size)
+
+    @staticmethod
+    def _cell_ids(lat: np.ndarray, lon: np.ndarray, size: float) -> np.ndarray:
+        n_lon = int(round(360 / size))
+        n_lat = int(np.ceil(180 / size)) + 1
+        i = np.clip(np.floor((np.asarray(lat) + 90) / size), 0, n_lat - 1).astype(np.int64)
+        j = np.floor((np.asarray(lon) + 180) / size).astype(np.int64) % n_lon
+        return i * n_lon + j
+
+    def _build(self, rows: np.ndarray):
+        """Sort rows by cell, and describe every occupied cell."""
+        self.cell_size = size = self._cell_size(rows)
+        self._n_lon_cells = int(round(360 / size))
+        self._n_lat_cells = int(np.ceil(180 / size)) + 1
+        ids = self._cell_ids(self.lat[rows], self.lon[rows], size)
+        order = np.argsort(ids, kind="stable")
+        self._rows = rows[order].astype(np.int32)
+        self._cells, starts = np.unique(ids[order], return_index=True)
+        self._offsets = np.append(starts, len(rows))
+        self._counts = np.diff(self._offsets)
+        i, j = np.divmod(self._cells, self._n_lon_cells)
+        # Cells of the last row are cut by the pole
+        min_lat = np.clip(i * size - 90, -90, 90)
+        max_lat = np.clip((i + 1) * size - 90, -90, 90)
+        self._center_lat = (min_lat + max_lat) / 2
+        self._center_lon = (j + 0.5) * size - 180
+        # Farthest a point of the cell can be from its center: one of the
+        # corners, with some slack
+        self._radius = 1.01 * np.maximum(
+            distances(self._center_lat, 0, min_lat, size / 2),
+            distances(self._center_lat, 0, max_lat, size / 2),
+        )
+        self._pending[rows] = False
+        self._pending_rows = []
+
+    def rebuild(self):
+        """Put every point in the grid now, e.g. after many puts."""
+        self._build(np.flatnonzero(self._present))
+
+    def _refresh(self):
+        """Rebuild the grid when too many points are pending."""
+        if len(self._pending_rows) > max(256, len(self._rows) // 32):
+            self.rebuild()
+
+    def _square(self, lat: float, lon: float, r: int) -> Tuple[np.ndarray, bool]:
+        """Occupied cells at most r cells away from the cell of (lat, lon), and
+        whether they are all of them."""
+        if 2 * r + 1 > len(self._cells):
+            # Looking at every cell is cheaper than cutting the square out
+            return np.arange(len(self._cells)), True
+        ci, cj = np.divmod(self._cell_ids(lat, lon, self.cell_size), self._n_lon_cells)
+        i = np.arange(max(ci - r, 0), min(ci + r, self._n_lat_cells - 1) + 1)
+        if 2 * r + 1 >= self._n_lon_cells:
+            spans = [(0, self._n_lon_cells - 1)]
+        elif cj - r < 0:
+            spans = [(0, cj + r), (cj - r + self._n_lon_cells, self._n_lon_cells - 1)]
+        elif cj + r >= self._n_lon_cells:
+            spans = [(cj - r, self._n_lon_cells - 1), (0, cj + r - self._n_lon_cells)]
+        else:
+            spans = [(cj - r, cj + r)]
+        cells = [
+            _ranges(
+                np.searchsorted(self._cells, i * self._n_lon_cells + j0, side="left"),
+                np.searchsorted(self._cells, i * self._n_lon_cells + j1, side="right"),
+            )
+            for j0, j1 in spans
+        ]
+        everything = (
+            2 * r + 1 >= self._n_lon_cells and ci - r <= 0 and ci + r >= self._n_lat_cells - 1
+        )
+        return np.concatenate(cells), everything
+
+    def _lower_bound(self, lat: float, r: int) -> float:
+        """Smallest possible distance in km to a point outside the square of r cells.
+
+        Such a point is at least r cells away in latitude, or in longitude. In
+        the latter case its latitude is within r cells of the query, which
+        bounds how much meridians can converge.
+        """
+        offset = min(r * self.cell_size, 180)
+        max_lat = np.radians(min(abs(lat) + offset, 90))
+        along_meridian = np.radians(offset)
+        along_parallel = 2 * np.arcsin(np.cos(max_lat) * np.sin(np.radians(offset) / 2))
+        return EARTH_RADIUS_KM * min(along_meridian, along_parallel)
+
+    def _candidates(
+        self, lat: float, lon: float, cells: np.ndarray, center_distances: np.ndarray, radius
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the cells that may hold points within radius km, plus the
+        pending rows, with their distances in km."""
+        near = cells[center_distances - self._radius[cells] <= radius]
+        rows = self._rows[_ranges(self._offsets[near], self._offsets[near + 1])]
+        rows = rows[self._present[rows] & ~self._pending[rows]]
+        pending = np.array(self._pending_rows, dtype=np.int64)
+        rows = np.concatenate([rows, pending[self._present[pending]]])
+        return rows, distances(lat, lon, self.lat[rows], self.lon[rows])
+
+    def _everyone(self, lat: float, lon: float) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.flatnonzero(self._present)
+        return rows, distances(lat, lon, self.lat[rows], self.lon[rows])
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[int, float]]:
+        """Return the k closest (row, distance) pairs, closest first."""
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        self._refresh()
+        # Grow the square until its cells hold k points
+        r = 0
+        cells, everything = self._square(lat, lon, r)
+        while self._counts[cells].sum() < k and not everything:
+            r = max(2 * r, 1)
+            cells, everything = self._square(lat, lon, r)
+        if self._counts[cells].sum() < k:
+            # Most points are pending
+            rows, row_distances = self._everyone(lat, lon)
+        else:
+            # The k-th nearest point is no further than the farthest point of
+            # the closest cells holding k points
+            center_distances = distances(lat, lon, self._center_lat[cells], self._center_lon[cells])
+            farthest = center_distances + self._radius[cells]
+            order = np.argsort(farthest)
+            bound = farthest[order][np.searchsorted(np.cumsum(self._counts[cells][order]), k)]
+            while not everything and self._lower_bound(lat, r) < bound:
+                r = max(2 * r, 1)
+                cells, everything = self._square(lat, lon, r)
+                center_distances = distances(
+                    lat, lon, self._center_lat[cells], self._center_lon[cells]
+                )
+            rows, row_distances = self._candidates(lat, lon, cells, center_distances, bound)
+            # Points that moved away since the last build may be missing
+            if len(rows) < k or np.partition(row_distances, k - 1)[k - 1] > bound:
+                rows, row_distances = self._everyone(lat, lon)
+        order = np.argsort(row_distances, kind="stable")[:k]
+        return [(int(rows[i]), float(row_distances[i])) for i in order]
+
+    def within(self, lat: float, lon: float, radius: float) -> List[Tuple[int, float]]:
+        """Return every (row, distance) pair closer than radius km, closest first."""
+        if not len(self):
+            return []
+        self._refresh()
+        r = 0
+        cells, everything = self._square(lat, lon, r)
+        while not everything and self._lower_bound(lat, r) <= radius:
+            r = max(2 * r, 1)
+            cells, everything = self._square(lat, lon, r)
+        center_distances = distances(lat, lon, self._center_lat[cells], self._center_lon[cells])
+        rows, row_distances = self._candidates(lat, lon, cells, center_distances, radius)
+        order = [i for i in np.argsort(row_distances, kind="stable") if row_distances[i] <= radius]
+        return [(int(rows[i]), float(row_distances[i])) for i in order]
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+STOPS_CSV = "data_gathering/output_data/slim_stops.csv"
+STATION_INDEX_DIR = "data_gathering/output_data/station_index"
+
+
+def _csv_version(csv_path: str, block_size: int = 2**20) -> str:
+    """Short sha256 of the stops table, naming the index built from it."""
+    h = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def _replace_text(path: str, content: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def build_station_index(csv_path: str = STOPS_CSV, index_dir: str = STATION_INDEX_DIR) -> str:
+    """Turn the stops table into a compact binary station index.
+
+    Names go in a JSON list, coordinates in contiguous .npy arrays that can be
+    memory-mapped, in the same order. Each version of the table gets its own
+    directory, named after its sha256, and the CURRENT file points to the
+    latest one. Files that other processes have mapped are never rewritten.
+    Return the directory of the index.
+    """
+    version = _csv_version(csv_path)
+    version_dir = os.path.join(index_dir, version)
+    if not os.path.isdir(version_dir):
+        stops = pd.read_csv(csv_path)
+        tmp_dir = f"{version_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, "stop_lat.npy"), stops["stop_lat"].to_numpy(np.float64))
+        np.save(os.path.join(tmp_dir, "stop_lon.npy"), stops["stop_lon"].to_numpy(np.float64))
+        with open(os.path.join(tmp_dir, "stop_names.json"), "w", encoding="utf-8") as f:
+            json.dump(list(stops["stop_name"]), f, ensure_ascii=False)
+        try:
+            os.replace(tmp_dir, version_dir)
+        except OSError:
+            # Another process built the same version first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    _replace_text(os.path.join(index_dir, "CURRENT"), version)
+    return version_dir
+
+
+class StationIndex:
+    """Station names with O(1) lookup of their memory-mapped coordinates."""
+
+    def __init__(self, names: List[str], lat: np.ndarray, lon: np.ndarray):
+        self.names = names
+        self.lat = lat
+        self.lon = lon
+        self.ids: Dict[str, int] = {}
+        for i, name in enumerate(names):
+            self.ids.setdefault(name, i)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def load(cls, index_dir: str = STATION_INDEX_DIR, csv_path: str = STOPS_CSV):
+        """Map the station index, building it first if it is missing or outdated."""
+        if os.path.exists(csv_path):
+            version_dir = os.path.join(index_dir, _csv_version(csv_path))
+            if not os.path.isdir(version_dir):
+                version_dir = build_station_index(csv_path, index_dir)
+        else:
+            with open(os.path.join(index_dir, "CURRENT"), encoding="utf-8") as f:
+                version_dir = os.path.join(index_dir, f.read().strip())
+        with open(os.path.join(version_dir, "stop_names.json"), encoding="utf-8") as f:
+            names = json.load(f)
+        lat = np.load(os.path.join(version_dir, "stop_lat.npy"), mmap_mode="r")
+        lon = np.load(os.path.join(version_dir, "stop_lon.npy"), mmap_mode="r")
+        return cls(names, lat, lon)
+
+    def coords(self, name: str) -> Dict[str, float]:
+        i = self.ids[name]
+        return {"lon": float(self.lon[i]), "lat": float(self.lat[i])}
+
+
+if __name__ == "__main__":
+    # Run from the root of the repo: python app/stations.py
+    build_station_index()
@@ -0,0 +1,317 @@
+import abc
+import contextlib
+import math
+import queue
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from distance import EARTH_RADIUS_KM, distances
+
+MATE_FIELDS = ["key", "name", "location_name", "lat", "lon"]
+
+# Half of a great circle: no two points are further apart
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+# The R*Tree stores positions as float32, which is off by a meter at most
+RTREE_MARGIN_KM = 0.01
+
+
+def sort_by_distance(mates: List[Dict], lat: float, lon: float, radius: float) -> List[Dict]:
+    """Keep mates closer than radius km to (lat, lon), closest first."""
+    if not mates:
+        return []
+    mates_distances = distances(
+        lat, lon, np.array([m["lat"] for m in mates]), np.array([m["lon"] for m in mates])
+    )
+    order = np.argsort(mates_distances, kind="stable")
+    return [mates[i] for i in order if mates_distances[i] <= radius]
+
+
+class MatesStorage(abc.ABC):
+    """Where mates are persisted. Records are dicts with MATE_FIELDS.
+
+    Backends implement put, get and fetch_all. Spatial queries fall back to
+    scanning fetch_all, and bulk_put to one put per mate.
+    """
+
+    # Whether nearest and within run inside the storage, or scan every mate
+    native_spatial_queries = False
+
+    @abc.abstractmethod
+    def put(self, mate: Dict, key: str):
+        """Insert or replace the mate stored under key."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Dict]:
+        """The mate stored under key, or None."""
+
+    def bulk_put(self, mates: List[Dict]):
+        """Put many mates at once. Each mate holds its own key."""
+        for mate in mates:
+            self.put(mate, key=mate["key"])
+
+    @abc.abstractmethod
+    def fetch_all(self) -> Iterator[Dict]:
+        """Every mate, in no particular order."""
+
+    def within(self, lat: float, lon: float, radius: float) -> List[Dict]:
+        """Mates closer than radius km to (lat, lon), closest first."""
+        return sort_by_distance(list(self.fetch_all()), lat, lon, radius)
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Dict]:
+        """The k mates closest to (lat, lon), closest first."""
+        return self.within(lat, lon, math.inf)[:k]
+
+
+class DetaStorage(MatesStorage):
+    """Mates in a Deta Base. Spatial queries fetch the whole table."""
+
+    def __init__(self, base, page_size: int = 1000):
+        self.base = base
+        self.page_size = page_size
+        # The Deta client reuses a single HTTP connection, which is not thread safe
+        self._lock = threading.Lock()
+
+    def put(self, mate: Dict, key: str):
+        with self._lock:
+            self.base.put(mate, key=key)
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            return self.base.get(key)
+
+    def bulk_put(self, mates: List[Dict]):
+        # Deta accepts at most 25 items per put_many
+        for start in range(0, len(mates), 25):
+            with self._lock:
+                self.base.put_many(mates[start : start + 25])
+
+    def fetch_all(self) -> Iterator[Dict]:
+        with self._lock:
+            res = self.base.fetch(limit=self.page_size)
+        yield from res.items
+        while res.last:
+            with self._lock:
+                res = self.base.fetch(limit=self.page_size, last=res.last)
+            yield from res.items
+
+
+class SqliteStorage(MatesStorage):
+    """Mates in a local SQLite file, with an R*Tree index on their positions.
+
+    Bounding-box pre-filtering runs inside the database, then exact distances
+    are computed on the few remaining candidates. Connections come from a pool,
+    so the storage can be shared by the threads Streamlit runs scripts in.
+    """
+
+    native_spatial_queries = True
+
+    def __init__(self, path: str = "mates.db", pool_size: int = 4):
+        self.path = path
+        self._pool: queue.Queue = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        with self._connection() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS mates (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT UNIQUE NOT NULL,
+                    name TEXT NOT NULL,
+                    location_name TEXT NOT NULL,
+                    lat REAL NOT NULL,
+                    lon REAL NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS mates_rtree
+                    USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextlib.contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection, inside a transaction."""
+        conn = self._pool.get()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._pool.put(conn)
+
+    def _upsert(self, conn: sqlite3.Connection, mate: Dict, key: str):
+        conn.execute(
+            """
+            INSERT INTO mates (key, name, location_name, lat, lon) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                name = excluded.name,
+                location_name = excluded.location_name,
+                lat = excluded.lat,
+                lon = excluded.lon
+            """,
+            (key, mate["name"], mate["location_name"], mate["lat"], mate["lon"]),
+        )
+        (mate_id,) = conn.execute("SELECT id FROM mates WHERE key = ?", (key,)).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO mates_rtree VALUES (?, ?, ?, ?, ?)",
+            (mate_id, mate["lat"], mate["lat"], mate["lon"], mate["lon"]),
+        )
+
+    def put(self, mate: Dict, key: str):
+        with self._connection() as conn:
+            self._upsert(conn, mate, key)
+
+    def bulk_put(self, mates: List[Dict]):
+        with self._connection() as conn:
+            for mate in mates:
+                self._upsert(conn, mate, mate["key"])
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._connection() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(MATE_FIELDS)} FROM mates WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else dict(row)
+
+    def fetch_all(self) -> Iterator[Dict]:
+        with self._connection() as conn:
+            rows = conn.execute(f"SELECT {', '.join(MATE_FIELDS)} FROM mates").fetchall()
+        return (dict(row) for row in rows)
+
+    @staticmethod
+    def _bounding_box(lat: float, lon: float, radius: float) -> List[Tuple[float, ...]]:
+        """(min_lat, max_lat, min_lon, max_lon) boxes around a circle of radius km.
+
+        There are two boxes when the circle crosses the antimeridian.
+        """
+        angle = radius / EARTH_RADIUS_KM
+        d_lat = math.degrees(angle)
+        min_lat, max_lat = max(lat - d_lat, -90.0), min(lat + d_lat, 90.0)
+        if abs(lat) + d_lat >= 90 or math.sin(angle) >= math.cos(math.radians(lat)):
+            # The circle contains a pole
+            return [(min_lat, max_lat, -180.0, 180.0)]
+        d_lon = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+        if lon - d_lon < -180:
+            lon_ranges = [(lon - d_lon + 360, 180.0), (-180.0, lon + d_lon)]
+        elif lon + d_lon > 180:
+            lon_ranges = [(lon - d_lon, 180.0), (-180.0, lon + d_lon - 360)]
+        else:
+            lon_ranges = [(lon - d_lon, lon + d_lon)]
+        return [(min_lat, max_lat, min_lon, max_lon) for min_lon, max_lon in lon_ranges]
+
+    def _count_in_box(
+        self, conn: sqlite3.Connection, lat: float, lon: float, radius: float
+    ) -> int:
+        """Mates in the bounding box of the circle, counted on the R*Tree only."""
+        return sum(
+            conn.execute(
+                """
+                SELECT COUNT(*) FROM mates_rtree
+                WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+                """,
+                box,
+            ).fetchone()[0]
+            for box in self._bounding_box(lat, lon, radius)
+        )
+
+    def _candidates(
+        self,
+        conn: sqlite3.Connection,
+        lat: float,
+        lon: float,
+        radius: float,
+        box_radius: Optional[float] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids and approximate distances in km of the mates within the circle.
+
+        Only the R*Tree is read, in the bounding box of the circle, or of a
+        circle of box_radius if given. Distances come from its float32
+        positions, and mates up to RTREE_MARGIN_KM past the radius are kept.
+        """
+        rows = []
+        for box in self._bounding_box(lat, lon, box_radius or radius):
+            rows += conn.execute(
+                """
+                SELECT id, (min_lat + max_lat) / 2, (min_lon + max_lon) / 2 FROM mates_rtree
+                WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+                """,
+                box,
+            ).fetchall()
+        positions = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        dists = distances(lat, lon, positions[:, 1], positions[:, 2])
+        inside = dists <= radius + RTREE_MARGIN_KM
+        return positions[inside, 0].astype(np.int64), dists[inside]
+
+    def _fetch_sorted(
+        self, conn: sqlite3.Connection, ids: np.ndarray, lat: float, lon: float, radius: float
+    ) -> List[Dict]:
+        """Mates with these ids closer than radius km, closest first."""
+        fields = ", ".join(MATE_FIELDS)
+        mates = []
+        # Stay under the limit of variables of a SQLite query
+        for start in range(0, len(ids), 500):
+            chunk = [int(i) for i in ids[start : start + 500]]
+            rows = conn.execute(
+                f"SELECT {fields} FROM mates WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            mates.extend(dict(row) for row in rows)
+        return sort_by_distance(mates, lat, lon, radius)
+
+    def within(self, lat: float, lon: float, radius: float) -> List[Dict]:
+        with self._connection() as conn:
+            ids, _ = self._candidates(conn, lat, lon, radius)
+            return self._fetch_sorted(conn, ids, lat, lon, radius)
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Dict]:
+        if k <= 0:
+            return []
+        with self._connection() as conn:
+            # Grow the box until it holds k mates, counting on the R*Tree only
+            low, high = 0.0, 1.0
+            count = self._count_in_box(conn, lat, lon, high)
+            while count < k and high < MAX_DISTANCE_KM:
+                low, high = high, min(high * 4, MAX_DISTANCE_KM)
+                count = self._count_in_box(conn, lat, lon, high)
+            # Then narrow it down, so that it holds few more than k mates
+            for _ in range(30):
+                if count <= 4 * k:
+                    break
+                middle = (low + high) / 2
+                middle_count = self._count_in_box(conn, lat, lon, middle)
+                if middle_count >= k:
+                    high, count = middle, middle_count
+                else:
+                    low = middle
+            ids, dists = self._candidates(conn, lat, lon, MAX_DISTANCE_KM, box_radius=high)
+            if len(ids) < k:
+                # There are fewer than k mates, and the box holds all of them
+                return self._fetch_sorted(conn, ids, lat, lon, MAX_DISTANCE_KM)
+            # The k nearest mates are no further than the k-th nearest mate
+            # of the box, but may lie outside of the box
+            radius = float(np.partition(dists, k - 1)[k - 1]) + RTREE_MARGIN_KM
+            ids, _ = self._candidates(conn, lat, lon, radius)
+            return self._fetch_sorted(conn, ids, lat, lon, radius)[:k]
+
+
+def get_storage(config: Mapping) -> MatesStorage:
+    """Pick the storage backend from config, e.g. the Streamlit secrets.
+
+    Set `storage = "sqlite"` (and optionally `sqlite_path`) to run offline.
+    Deta is the default and needs `deta_key`.
+    """
+    backend = config.get("storage", "deta")
+    if backend == "sqlite":
+        return SqliteStorage(config.get("sqlite_path", "mates.db"))
+    if backend == "deta":
+        from deta import Deta
+
+        return DetaStorage(Deta(config["deta_key"]).Base("mates"))
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,186 @@
+"""Benchmark the mate search path on synthetic populations.
+
+Run from the root of the repo:
+
+    python benchmarks/bench_search.py --sizes 1e3,1e4,1e5
+    python benchmarks/bench_search.py --baseline bench_baseline.json --threshold 0.2
+
+Mates are generated around the real stations of slim_stops.csv, page by page
+as a stand-in for the Deta Base reads them, so only the MatesCache holds the
+whole population. It takes about 0.25 KB per mate, and twice that while a
+reload builds new columns: 1e7 mates need about 5 GB. For each population
+size, every stage of the search path is timed and its p50/p99 latency,
+throughput and peak memory are written to a JSON file. With --baseline, the
+run fails if a stage got slower than the baseline by more than --threshold,
+and by more than --min-delta-ms.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from functions import (  # noqa: E402
+    find_mates,
+    get_plotting_zoom_level_and_center_coordinates_from_lonlat_tuples,
+)
+from mates_cache import MatesCache  # noqa: E402
+from stations import StationIndex  # noqa: E402
+from storage import DetaStorage  # noqa: E402
+
+
+class GeneratedBase:
+    """Read-only stand-in for deta.Base, holding n mates living around random
+    stations, about spread_km away.
+
+    Only their station ids and positions are kept, and records are built
+    page by page when fetched.
+    """
+
+    def __init__(self, stations: StationIndex, n: int, spread_km: float = 1.0, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.stations = stations
+        self.ids = rng.integers(0, len(stations), n).astype(np.int32)
+        spread = spread_km / 111
+        self.lat = np.asarray(stations.lat)[self.ids] + rng.normal(0, spread, n)
+        self.lon = np.asarray(stations.lon)[self.ids] + rng.normal(0, spread, n) / np.cos(
+            np.radians(self.lat)
+        )
+
+    def get(self, key: str):
+        i = int(key.rsplit(" ", 1)[1])
+        return {
+            "key": key,
+            "name": key,
+            "location_name": self.stations.names[self.ids[i]],
+            "lat": float(self.lat[i]),
+            "lon": float(self.lon[i]),
+        }
+
+    def fetch(self, limit: int = 1000, last: str = None):
+        start = 0 if last is None else int(last.rsplit(" ", 1)[1]) + 1
+        stop = min(start + limit, len(self.ids))
+        items = [self.get(f"mate {i}") for i in range(start, stop)]
+        return SimpleNamespace(
+            items=items, last=items[-1]["key"] if stop < len(self.ids) else None
+        )
+
+
+def measure(run: Callable, n_calls: int) -> Dict[str, float]:
+    """Time n_calls calls of run(i), then measure its peak memory on one call."""
+    latencies = np.empty(n_calls)
+    for i in range(n_calls):
+        start = time.perf_counter()
+        run(i)
+        latencies[i] = time.perf_counter() - start
+    tracemalloc.start()
+    run(0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "throughput_per_s": float(n_calls / latencies.sum()),
+        "peak_memory_mb": peak / 2**20,
+    }
+
+
+def bench_size(
+    stations: StationIndex, n: int, n_queries: int, n_refreshes: int, seed: int
+) -> Dict[str, Dict]:
+    storage = DetaStorage(GeneratedBase(stations, n, seed=seed))
+    mates = MatesCache(storage, max_mates=max(n, 1))
+
+    rng = np.random.default_rng(seed + 1)
+    queries = [stations.names[i] for i in rng.integers(0, len(stations), n_queries)]
+    coords = [stations.coords(name) for name in queries]
+    sample = find_mates(mates, coords[0])
+
+    return {
+        "cache_refresh": measure(lambda i: mates.refresh(), n_refreshes),
+        "get_coords": measure(lambda i: stations.coords(queries[i]), n_queries),
+        "find_mates": measure(lambda i: find_mates(mates, coords[i]), n_queries),
+        "zoom": measure(
+            lambda i: get_plotting_zoom_level_and_center_coordinates_from_lonlat_tuples(
+                sample["lon"], sample["lat"]
+            ),
+            n_queries,
+        ),
+    }
+
+
+def regressions(
+    results: Dict, baseline: Dict, threshold: float, min_delta_ms: float = 0.05
+) -> List[str]:
+    """Stages whose latency grew by more than threshold compared to baseline.
+
+    Growths under min_delta_ms are timer noise, and are not reported.
+    """
+    found = []
+    for size, stages in results.items():
+        for stage, metrics in stages.items():
+            before = baseline.get(size, {}).get(stage)
+            if before is None:
+                continue
+            for metric in ["p50_ms", "p99_ms"]:
+                if (
+                    metrics[metric] > before[metric] * (1 + threshold)
+                    and metrics[metric] - before[metric] > min_delta_ms
+                ):
+                    found.append(
+                        f"{size} mates, {stage} {metric}: "
+                        f"{before[metric]:.3f} -> {metrics[metric]:.3f}"
+                    )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", default="1e3,1e4,1e5", help="Comma separated. 1e7 needs about 5 GB"
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--refreshes", type=int, default=5, help="Full cache reloads timed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Previous results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--min-delta-ms", type=float, default=0.05)
+    args = parser.parse_args()
+
+    # Read before running, as --output may overwrite the same file
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    stations = StationIndex.load()
+    results = {}
+    for size in [int(float(s)) for s in args.sizes.split(",")]:
+        results[str(size)] = bench_size(stations, size, args.queries, args.refreshes, args.seed)
+        for stage, metrics in results[str(size)].items():
+            print(
+                f"{size:>10} mates  {stage:<14} p50 {metrics['p50_ms']:9.3f} ms  "
+                f"p99 {metrics['p99_ms']:9.3f} ms  {metrics['throughput_per_s']:10.0f}/s  "
+                f"{metrics['peak_memory_mb']:8.1f} MB"
+            )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.threshold, args.min_delta_ms)
+        for regression in found:
+            print(f"Regression: {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
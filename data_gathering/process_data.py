@@ -1,31 +1,173 @@
-#%%
+"""Build output_data/slim_stops.csv from a raw list of stops.
+
+Run from the data_gathering folder:
+
+    python process_data.py
+    python process_data.py --format gtfs --input data/stops.txt
+
+The input is read in chunks, and each chunk is folded into running sums per
+station, so memory grows with the number of stations rather than of rows.
+Stops are aggregated by station, and the coordinates of a station are the
+mean of its stops. Nothing is done if the input did not change since the last run.
+"""
+import argparse
+import hashlib
+import os
+import resource
+import sys
+import time
 
 import pandas as pd
 
-# %%
+# Bump when the output changes for a same input, to invalidate previous runs
+PIPELINE_VERSION = "3"
+
+
+def file_hash(path: str, fmt: str, block_size: int = 2**20) -> str:
+    """Hash the input content, its format and the pipeline version."""
+    h = hashlib.sha256(f"{PIPELINE_VERSION}:{fmt}".encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_idf(path: str, chunksize: int):
+    """Stations of Ile-de-France Mobilites, grouped by name."""
+    for chunk in pd.read_csv(
+        path, sep=";", usecols=["Geo Point", "nom_lda", "res_com"], chunksize=chunksize
+    ):
+        coords = chunk["Geo Point"].str.split(",", n=1, expand=True).astype(float)
+        yield pd.DataFrame(
+            {
+                "key": chunk["nom_lda"],
+                "name": chunk["nom_lda"],
+                "child_name": None,
+                "stop_lat": coords[0],
+                "stop_lon": coords[1],
+                "lines": chunk["res_com"].fillna("").astype(str),
+            }
+        )
+
+
+def read_gtfs(path: str, chunksize: int):
+    """Stops of a GTFS stops.txt, grouped by parent station.
+
+    Only stops and stations are kept: entrances, generic nodes and boarding
+    areas (location_type 2 to 4) are not where people wait, and often have no
+    coordinates. Stations are named after their own row, if it is in the file.
+    """
+    for chunk in pd.read_csv(
+        path, dtype={"stop_id": str, "parent_station": str}, chunksize=chunksize
+    ):
+        if "location_type" in chunk:
+            location_type = pd.to_numeric(chunk["location_type"], errors="coerce").fillna(0)
+            chunk = chunk[location_type.isin([0, 1])]
+        lat = pd.to_numeric(chunk["stop_lat"], errors="coerce")
+        lon = pd.to_numeric(chunk["stop_lon"], errors="coerce")
+        chunk, lat, lon = (x[lat.notna() & lon.notna()] for x in (chunk, lat, lon))
+        key = chunk["stop_id"]
+        if "parent_station" in chunk:
+            key = chunk["parent_station"].fillna(key)
+        is_station = key == chunk["stop_id"]
+        yield pd.DataFrame(
+            {
+                "key": key,
+                "name": chunk["stop_name"].where(is_station),
+                "child_name": chunk["stop_name"].where(~is_station),
+                "stop_lat": lat,
+                "stop_lon": lon,
+                "lines": "",
+            }
+        )
+
+
+READERS = {"idf": read_idf, "gtfs": read_gtfs}
+
+
+def aggregate(stops: pd.DataFrame) -> pd.DataFrame:
+    """Sum coordinates and join lines per station, in a single groupby.
+
+    Names are the first that is not missing, so the row of a station wins
+    over the rows of its stops, whatever chunk it is in.
+    """
+    return stops.groupby("key").agg(
+        name=("name", "first"),
+        child_name=("child_name", "first"),
+        lat_sum=("lat_sum", "sum"),
+        lon_sum=("lon_sum", "sum"),
+        n=("n", "sum"),
+        lines=("lines", " ".join),
+    )
+
+
+def process(input_path: str, output_path: str, fmt: str, chunksize: int) -> int:
+    """Write the slim stops table and return the number of input rows."""
+    rows = 0
+    stations = None
+    for chunk in READERS[fmt](input_path, chunksize):
+        rows += len(chunk)
+        chunk["lat_sum"] = chunk["stop_lat"]
+        chunk["lon_sum"] = chunk["stop_lon"]
+        chunk["n"] = 1
+        partial = aggregate(chunk).reset_index()
+        if stations is not None:
+            # Earlier chunks come first, so that their names win
+            partial = aggregate(pd.concat([stations, partial], ignore_index=True)).reset_index()
+        stations = partial
+    stations = stations.set_index("key")
+    stations["name"] = stations["name"].fillna(stations["child_name"])
+
+    lines = stations["lines"].str.split().str.join(" ")
+    slim_stops = pd.DataFrame(
+        {
+            "stop_name": stations["name"].where(
+                lines == "", stations["name"] + " (" + lines + ")"
+            ),
+            "stop_lon": stations["lon_sum"] / stations["n"],
+            "stop_lat": stations["lat_sum"] / stations["n"],
+        }
+    )
+    slim_stops.drop_duplicates(subset=["stop_name"], inplace=True)
+    slim_stops.reset_index(drop=True).to_csv(output_path)
+    return rows
 
-stops = pd.read_csv("data/emplacement-des-gares-idf.csv", sep=";")
 
-# %%
+def peak_memory_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
 
-stops["stop_lat"] = stops["Geo Point"].apply(lambda x: float(x.split(",")[0]))
-stops["stop_lon"] = stops["Geo Point"].apply(lambda x: float(x.split(",")[1]))
 
-# %%
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", default="data/emplacement-des-gares-idf.csv")
+    parser.add_argument("--output", default="output_data/slim_stops.csv")
+    parser.add_argument("--format", choices=sorted(READERS), default="idf")
+    parser.add_argument("--chunksize", type=int, default=500_000)
+    parser.add_argument(
+        "--force", action="store_true", help="Rebuild even if the input did not change"
+    )
+    args = parser.parse_args()
 
-slim_stops = stops.groupby("nom_lda").apply(lambda s: pd.Series({ 
-    "stop_lon": s["stop_lon"].mean(), 
-    "stop_lat": s["stop_lat"].mean(), 
-    "lines": list(s["res_com"]), 
-})).reset_index()
+    hash_path = args.output + ".sha256"
+    input_hash = file_hash(args.input, args.format)
+    if not args.force and os.path.exists(args.output) and os.path.exists(hash_path):
+        with open(hash_path) as f:
+            if f.read().strip() == input_hash:
+                print(f"{args.input} did not change, nothing to do")
+                return
 
-# %%
-slim_stops["stop_name"] = slim_stops.apply(lambda x: f"{x['nom_lda']} ({' '.join(x['lines'])})", axis=1)
+    start = time.perf_counter()
+    rows = process(args.input, args.output, args.format, args.chunksize)
+    elapsed = time.perf_counter() - start
+    with open(hash_path, "w") as f:
+        f.write(input_hash)
+    print(
+        f"Processed {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s), "
+        f"peak memory {peak_memory_mb():.0f} MB"
+    )
 
-# %%
 
-slim_stops = slim_stops[["stop_name", "stop_lon", "stop_lat"]]
-slim_stops.drop_duplicates(subset=["stop_name"], inplace=True)
-# %%
-slim_stops.to_csv("output_data/slim_stops.csv")
-# %%
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The app modules import each other by name, as Streamlit runs app/main.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+# process_data.py is a script run from its own folder
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "data_gathering"))
@@ -0,0 +1,56 @@
+import numpy as np
+
+from clustering import MAP_HEIGHT, MAP_WIDTH, POINTS_ZOOM, STATION_ZOOM, TILE_SIZE, ClusterPyramid
+
+
+def paris_pyramid(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    lat, lon = rng.uniform(48.7, 49.0, n), rng.uniform(2.2, 2.5, n)
+    names = [f"mate {i}" for i in range(n)]
+    return ClusterPyramid(lat, lon, names, [f"station {i % 50}" for i in range(n)])
+
+
+def in_view(clusters, zoom, center):
+    """Whether markers show on a map drawn at zoom around center."""
+    degrees_per_pixel = 360 / (TILE_SIZE * 2**zoom)
+    half_height = MAP_HEIGHT / 2 * degrees_per_pixel * np.cos(np.radians(center["lat"]))
+    return (
+        (np.abs(clusters["lat"] - center["lat"]) <= half_height)
+        & (np.abs(clusters["lon"] - center["lon"]) <= MAP_WIDTH / 2 * degrees_per_pixel)
+    ).all()
+
+
+def test_empty_pyramid():
+    pyramid = ClusterPyramid.from_mates([])
+    assert pyramid.busiest_location() is None
+    for zoom in range(POINTS_ZOOM + 1):
+        clusters, _ = pyramid.clusters(zoom, center={"lat": 48.85, "lon": 2.35})
+        assert len(clusters) == 0
+
+
+def test_every_mate_is_counted_once():
+    pyramid = paris_pyramid()
+    for zoom in range(POINTS_ZOOM + 1):
+        clusters, clusters_zoom = pyramid.clusters(zoom, max_points=10_000)
+        assert clusters_zoom == zoom
+        assert clusters["count"].sum() == 500
+    assert len(pyramid.clusters(STATION_ZOOM, max_points=10_000)[0]) == 50
+
+
+def test_markers_are_in_view():
+    pyramid = paris_pyramid()
+    center = {"lat": 48.85, "lon": 2.35}
+    for zoom in range(POINTS_ZOOM + 1):
+        clusters, clusters_zoom = pyramid.clusters(zoom, center=center)
+        assert len(clusters) > 0
+        assert in_view(clusters, clusters_zoom, center)
+
+
+def test_empty_view_falls_back_to_coarser_levels():
+    pyramid = paris_pyramid()
+    # Nobody lives in Lyon: the map zooms out to the mates of Paris
+    lyon = {"lat": 45.76, "lon": 4.84}
+    clusters, zoom = pyramid.clusters(POINTS_ZOOM, center=lyon)
+    assert zoom < STATION_ZOOM
+    assert clusters["count"].sum() == 500
+    assert in_view(clusters, zoom, lyon)
@@ -0,0 +1,97 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+import digest
+from functions import find_mates
+from storage import SqliteStorage
+
+
+@pytest.fixture(scope="module")
+def storage_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("digest") / "mates.db")
+    rng = np.random.default_rng(0)
+    # A crowd in Paris, a few mates far from anyone, and some across the antimeridian
+    lat = np.concatenate([rng.normal(48.85, 0.05, 300), rng.uniform(-80, 80, 20), [-17.7] * 3])
+    lon = np.concatenate([rng.normal(2.35, 0.08, 300), rng.uniform(-180, 180, 20)])
+    lon = np.concatenate([lon, [179.98, -179.97, 179.99]])
+    SqliteStorage(path).bulk_put(
+        [
+            {
+                "key": f"mate {i}",
+                "name": f"mate {i}",
+                "location_name": f"station {i % 40}",
+                "lat": float(lat[i]),
+                "lon": float(lon[i]),
+            }
+            for i in range(len(lat))
+        ]
+    )
+    return path
+
+
+def run_digest(monkeypatch, storage_path: str, output: str, *options: str):
+    argv = ["digest.py", "--storage", "sqlite", "--sqlite-path", storage_path]
+    argv += ["--output", output, "--processes", "2", "--max-rows", "50"]
+    monkeypatch.setattr(sys, "argv", argv + list(options))
+    digest.main()
+
+
+@pytest.mark.parametrize("exclude_self", [False, True])
+def test_digest_matches_find_mates(storage_path, tmp_path, monkeypatch, exclude_self):
+    output = str(tmp_path / "digest.jsonl")
+    run_digest(monkeypatch, storage_path, output, *(["--exclude-self"] if exclude_self else []))
+
+    storage = SqliteStorage(storage_path)
+    with open(output, encoding="utf-8") as f:
+        records = {r["key"]: r["mates"] for r in map(json.loads, f)}
+    mates = {m["key"]: m for m in storage.fetch_all()}
+    assert records.keys() == mates.keys()
+    for key, got in records.items():
+        assert len(got) == 6
+        assert not exclude_self or key not in [m["key"] for m in got]
+        expected = find_mates(storage, mates[key], 6 + exclude_self)
+        if exclude_self:
+            expected = expected[expected["key"] != key].head(6)
+        # Mates are ranked by great-circle distance, so geodesic ones may be out of order
+        np.testing.assert_allclose(
+            sorted(m["distance (km)"] for m in got), np.sort(expected["distance (km)"]), atol=1e-9
+        )
+
+
+def test_check_finds_mismatches(storage_path, tmp_path, monkeypatch):
+    output = str(tmp_path / "digest.jsonl")
+    # Every mate is checked, and the run fails if one differs from find_mates
+    run_digest(monkeypatch, storage_path, output, "--check", "1000")
+
+    storage = SqliteStorage(storage_path)
+    mates = list(storage.fetch_all())
+    keys = [m["key"] for m in mates]
+    lat, lon = np.array([m["lat"] for m in mates]), np.array([m["lon"] for m in mates])
+    with open(output, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    for record in records:
+        if record["key"] == "mate 0":
+            record["mates"][-1]["distance (km)"] += 1
+    with open(output, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(r) + "\n" for r in records)
+    assert digest.check(storage, lat, lon, keys, output, len(keys), False) == ["mate 0"]
+
+
+def test_parquet_round_trip(storage_path, tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    jsonl_output, parquet_output = str(tmp_path / "digest.jsonl"), str(tmp_path / "digest.parquet")
+    run_digest(monkeypatch, storage_path, jsonl_output)
+    run_digest(monkeypatch, storage_path, parquet_output, "--check", "1000")
+
+    with open(jsonl_output, encoding="utf-8") as f:
+        expected = {r["key"]: r["mates"] for r in map(json.loads, f)}
+    got = {r["key"]: r["mates"] for r in pq.read_table(parquet_output).to_pylist()}
+    assert got.keys() == expected.keys()
+    for key, mates in got.items():
+        assert [m["key"] for m in mates] == [m["key"] for m in expected[key]]
+        np.testing.assert_allclose(
+            [m["distance (km)"] for m in mates], [m["distance (km)"] for m in expected[key]]
+        )
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+
+from distance import distances, pairwise
+
+
+def geopy_km(lat, lon, lats, lons):
+    return np.array([geodesic((lat, lon), (a, b)).km for a, b in zip(lats, lons)])
+
+
+def test_vincenty_matches_geopy_on_random_pairs():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        lat, lon = rng.uniform(-89, 89), rng.uniform(-180, 180)
+        lats, lons = rng.uniform(-89, 89, 50), rng.uniform(-180, 180, 50)
+        np.testing.assert_allclose(
+            distances(lat, lon, lats, lons, method="vincenty"),
+            geopy_km(lat, lon, lats, lons),
+            atol=1e-6,
+        )
+
+
+@pytest.mark.parametrize(
+    "lat, lon, lats, lons",
+    [
+        # Along the equator, where cos2_alpha is 0
+        (0, 0, [0, 0, 0], [1, 90, -120]),
+        # Same point
+        (48.85, 2.35, [48.85], [2.35]),
+        (0, 0, [0], [0]),
+        # Nearly antipodal points, where the iteration converges slowly
+        (0, 0, [0.1, 0.5, -0.3], [179.5, 179.0, 179.8]),
+    ],
+)
+def test_vincenty_matches_geopy_on_edge_cases(lat, lon, lats, lons):
+    np.testing.assert_allclose(
+        distances(lat, lon, lats, lons, method="vincenty"),
+        geopy_km(lat, lon, lats, lons),
+        atol=1e-6,
+    )
+
+
+def test_haversine_is_close_to_geopy():
+    rng = np.random.default_rng(1)
+    lats, lons = rng.uniform(-89, 89, 100), rng.uniform(-180, 180, 100)
+    expected = geopy_km(48.85, 2.35, lats, lons)
+    # The sphere is off by at most about 0.5% from the ellipsoid
+    np.testing.assert_allclose(distances(48.85, 2.35, lats, lons), expected, rtol=6e-3)
+
+
+@pytest.mark.parametrize("method", ["haversine", "vincenty"])
+def test_pairwise_matches_distances_in_small_chunks(method):
+    rng = np.random.default_rng(2)
+    lats1, lons1 = rng.uniform(-89, 89, 37), rng.uniform(-180, 180, 37)
+    lats2, lons2 = rng.uniform(-89, 89, 11), rng.uniform(-180, 180, 11)
+    matrix = pairwise(lats1, lons1, lats2, lons2, method=method, max_bytes=1)
+    assert matrix.shape == (37, 11)
+    for i in range(37):
+        np.testing.assert_allclose(
+            matrix[i], distances(lats1[i], lons1[i], lats2, lons2, method=method)
+        )
+    square = pairwise(lats1, lons1, method=method, max_bytes=2000)
+    np.testing.assert_allclose(np.diag(square), 0, atol=1e-9)
@@ -0,0 +1,44 @@
+import pandas as pd
+
+from functions import add_own_mate
+
+
+def results(n: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "key": [f"mate {i}" for i in range(n)],
+            "name": [f"mate {i}" for i in range(n)],
+            "location_name": "Nation",
+            "lat": 48.85,
+            "lon": 2.4,
+            "distance (km)": [0.5 * (i + 1) for i in range(n)],
+        }
+    )
+
+
+def own(key: str = "me") -> dict:
+    return {"key": key, "name": "me", "location_name": "Nation", "lat": 48.85, "lon": 2.4}
+
+
+def test_own_mate_comes_first():
+    mates_df = add_own_mate(results(6), own(), min_mates=6)
+    assert len(mates_df) == 6
+    assert mates_df.iloc[0]["key"] == "me"
+    assert mates_df.iloc[0]["distance (km)"] == 0.0
+    assert list(mates_df["key"][1:]) == [f"mate {i}" for i in range(5)]
+
+
+def test_own_mate_replaces_stale_record():
+    # Search results read before the mate moved here
+    stale = results(6)
+    stale.loc[3, "location_name"] = "Bastille"
+    mates_df = add_own_mate(stale, {**own("mate 3"), "name": "mate 3"}, min_mates=6)
+    assert list(mates_df["key"]).count("mate 3") == 1
+    assert mates_df.iloc[0]["location_name"] == "Nation"
+    assert len(mates_df) == 6
+
+
+def test_keeps_min_mates_rows():
+    assert len(add_own_mate(results(10), own(), min_mates=4)) == 4
+    assert len(add_own_mate(results(2), own(), min_mates=6)) == 3
+    assert list(add_own_mate(results(0), own(), min_mates=6)["key"]) == ["me"]
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from instrumentation import StageTimer
+
+
+@pytest.fixture
+def timer():
+    timer = StageTimer(buckets=(0.01, 0.1, 1))
+    for seconds in [0.005, 0.01, 0.05, 0.5, 3]:
+        timer.observe("search", seconds)
+    timer.observe("map", 0.2)
+    return timer
+
+
+def test_buckets_are_cumulative(timer):
+    histograms = timer.to_json()
+    # Bounds are inclusive, and slower observations only count in +Inf
+    assert histograms["search"] == {
+        "buckets": {"0.01": 2, "0.1": 3, "1": 4, "+Inf": 5},
+        "sum": pytest.approx(3.565),
+        "count": 5,
+    }
+    assert histograms["map"]["buckets"] == {"0.01": 0, "0.1": 0, "1": 1, "+Inf": 1}
+
+
+def test_stage_times_the_block_even_if_it_raises():
+    timer = StageTimer()
+    with pytest.raises(ValueError):
+        with timer.stage("search"):
+            raise ValueError
+    assert timer.timed("search", lambda x: x + 1)(1) == 2
+    assert timer.to_json()["search"]["count"] == 2
+
+
+def test_prometheus_format(timer):
+    lines = timer.to_prometheus().splitlines()
+    assert lines[:2] == [
+        "# HELP meet_mates_stage_seconds Latency of each stage of a search.",
+        "# TYPE meet_mates_stage_seconds histogram",
+    ]
+    assert 'meet_mates_stage_seconds_bucket{stage="search",le="0.1"} 3' in lines
+    assert 'meet_mates_stage_seconds_bucket{stage="search",le="+Inf"} 5' in lines
+    assert 'meet_mates_stage_seconds_count{stage="search"} 5' in lines
+    assert 'meet_mates_stage_seconds_sum{stage="map"} 0.2' in lines
+
+
+def test_dump(timer, tmp_path):
+    json_path, text_path = tmp_path / "stages.json", tmp_path / "stages.prom"
+    timer.dump(str(json_path))
+    timer.dump(str(text_path))
+    assert json.loads(json_path.read_text())["search"]["count"] == 5
+    assert text_path.read_text() == timer.to_prometheus()
+    # Temporary files are renamed away
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["stages.json", "stages.prom"]
@@ -0,0 +1,144 @@
+import threading
+from types import SimpleNamespace
+from typing import Dict, List
+
+import pytest
+
+import mates_cache
+from mates_cache import MatesCache
+from storage import DetaStorage, sort_by_distance
+
+
+class InMemoryBase:
+    """Stand-in for deta.Base that keeps items in a dict."""
+
+    def __init__(self):
+        self.items: Dict[str, Dict] = {}
+        # Insertion order of keys, to page through items like Deta does
+        self.keys: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.fetches = 0
+
+    def put(self, data: Dict, key: str):
+        if key not in self.items:
+            self.positions[key] = len(self.keys)
+            self.keys.append(key)
+        self.items[key] = {**data, "key": key}
+
+    def put_many(self, items: List[Dict]):
+        for item in items:
+            self.put(item, key=item["key"])
+
+    def get(self, key: str):
+        return self.items.get(key)
+
+    def fetch(self, limit: int = 1000, last: str = None):
+        self.fetches += 1
+        start = 0 if last is None else self.positions[last] + 1
+        page = self.keys[start : start + limit]
+        more = start + limit < len(self.keys)
+        return SimpleNamespace(
+            items=[self.items[key] for key in page], last=page[-1] if more else None
+        )
+
+
+def mate(i: int) -> Dict:
+    return {
+        "key": f"mate {i}",
+        "name": f"mate {i}",
+        "location_name": f"station {i % 7}",
+        "lat": 48.8 + i * 1e-3,
+        "lon": 2.3 + i * 1e-3,
+    }
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=0.0)
+    monkeypatch.setattr(mates_cache.time, "monotonic", lambda: now.t)
+    return now
+
+
+def make_cache(n: int, page_size: int = 1000, **kwargs):
+    base = InMemoryBase()
+    base.put_many([mate(i) for i in range(n)])
+    return base, MatesCache(DetaStorage(base, page_size=page_size), **kwargs)
+
+
+def test_reads_every_page():
+    base, cache = make_cache(2500)
+    assert len(cache.fetch_all()) == 2500
+    assert base.fetches == 3
+    assert cache.get("mate 2499")["location_name"] == "station 0"
+
+
+def test_put_writes_through(clock):
+    base, cache = make_cache(10)
+    cache.fetch_all()
+    cache.put({**mate(3), "lat": 45.76, "lon": 4.84}, key="mate 3")
+    cache.put(mate(10), key="mate 10")
+    assert base.items["mate 3"]["lat"] == 45.76
+    assert cache.get("mate 3")["lat"] == pytest.approx(45.76)
+    assert cache.nearest(45.76, 4.84, 1)[0]["key"] == "mate 3"
+    assert len(cache.fetch_all()) == 11
+    assert cache.refreshes == 1
+
+
+def test_reloads_after_ttl_or_invalidate(clock):
+    base, cache = make_cache(10, ttl=60)
+    cache.fetch_all()
+    # Written by another process
+    base.put(mate(10), key="mate 10")
+    clock.t = 59
+    assert cache.get("mate 10") is None
+    clock.t = 61
+    assert cache.get("mate 10") is not None
+    base.put(mate(11), key="mate 11")
+    cache.invalidate()
+    assert cache.get("mate 11") is not None
+    assert cache.stats() == {
+        "mates": 12,
+        "hits": 1,
+        "misses": 3,
+        "refreshes": 3,
+        "storage_reads": 0,
+    }
+
+
+def test_full_cache_reads_from_storage():
+    base, cache = make_cache(20, max_mates=10)
+    with pytest.warns(UserWarning, match="full"):
+        nearest = cache.nearest(48.8, 2.3, 3)
+    assert [m["key"] for m in nearest] == ["mate 0", "mate 1", "mate 2"]
+    expected = sort_by_distance(list(base.items.values()), 48.81, 2.31, 1)
+    assert cache.within(48.81, 2.31, 1) == expected
+    assert cache.get("mate 19")["key"] == "mate 19"
+    assert len(cache.fetch_all()) == 20
+    assert cache.stats()["storage_reads"] == 4
+
+
+def test_reads_are_served_during_a_reload():
+    base, cache = make_cache(10)
+    cache.fetch_all()
+    fetch_all, reading, release = cache.storage.fetch_all, threading.Event(), threading.Event()
+
+    def slow_fetch_all():
+        mates = list(fetch_all())
+        reading.set()
+        release.wait(5)
+        yield from mates
+
+    cache.storage.fetch_all = slow_fetch_all
+    base.put(mate(10), key="mate 10")
+    cache.invalidate()
+    reload = threading.Thread(target=cache.fetch_all)
+    reload.start()
+    assert reading.wait(5)
+    # The previous columns are served while the table is read
+    assert len(cache.fetch_all()) == 10
+    # Missed by the reload, which read the table before
+    cache.put(mate(11), key="mate 11")
+    release.set()
+    reload.join()
+    keys = {m["key"] for m in cache.fetch_all()}
+    assert {"mate 10", "mate 11"} <= keys
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+from process_data import process
+
+STOPS_TXT = """stop_id,stop_name,stop_lat,stop_lon,location_type,parent_station
+P1,Gare de Lyon - Quai 1,48.8440,2.3740,0,S1
+P2,Gare de Lyon - Quai 2,48.8446,2.3748,,S1
+S1,Gare de Lyon,48.8443,2.3744,1,
+E1,Gare de Lyon - Sortie Diderot,48.8460,2.3770,2,S1
+B1,Boarding,,,4,P1
+N1,Nation,48.8484,2.3959,0,
+Q1,Quai sans gare,48.8500,2.3500,0,S2
+"""
+
+
+@pytest.mark.parametrize("chunksize", [2, 100])
+def test_gtfs_keeps_stops_and_stations(tmp_path, chunksize):
+    input_path, output_path = tmp_path / "stops.txt", tmp_path / "slim_stops.csv"
+    input_path.write_text(STOPS_TXT)
+    process(str(input_path), str(output_path), "gtfs", chunksize)
+    stops = pd.read_csv(output_path, index_col=0).set_index("stop_name")
+    assert sorted(stops.index) == ["Gare de Lyon", "Nation", "Quai sans gare"]
+    # Named after its own row, and the entrance is not averaged in its position
+    assert stops.loc["Gare de Lyon", "stop_lat"] == pytest.approx((48.8443 + 48.8440 + 48.8446) / 3)
+    assert stops.loc["Gare de Lyon", "stop_lon"] == pytest.approx((2.3744 + 2.3740 + 2.3748) / 3)
+
+
+IDF_CSV = """Geo Point;nom_lda;res_com;mode
+48.8443,2.3744;Gare de Lyon;RER A;RER
+48.8449,2.3732;Gare de Lyon;METRO 14;METRO
+48.8484,2.3959;Nation;;METRO
+48.8437,2.3750;Gare de Lyon;METRO 1;METRO
+"""
+
+
+@pytest.mark.parametrize("chunksize", [1, 100])
+def test_idf_groups_stations_by_name(tmp_path, chunksize):
+    input_path, output_path = tmp_path / "gares.csv", tmp_path / "slim_stops.csv"
+    input_path.write_text(IDF_CSV)
+    assert process(str(input_path), str(output_path), "idf", chunksize) == 4
+    stops = pd.read_csv(output_path, index_col=0).set_index("stop_name")
+    assert sorted(stops.index) == ["Gare de Lyon (RER A METRO 14 METRO 1)", "Nation"]
+    gare_de_lyon = stops.loc["Gare de Lyon (RER A METRO 14 METRO 1)"]
+    assert gare_de_lyon["stop_lat"] == pytest.approx((48.8443 + 48.8449 + 48.8437) / 3)
+    assert gare_de_lyon["stop_lon"] == pytest.approx((2.3744 + 2.3732 + 2.3750) / 3)
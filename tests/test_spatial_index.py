@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from distance import distances
+from spatial_index import GridIndex
+
+
+def population(n: int, seed: int = 0):
+    """A dense city, a sparse country, and mates near the poles and the antimeridian."""
+    rng = np.random.default_rng(seed)
+    lat = np.concatenate(
+        [
+            rng.normal(48.85, 0.05, n // 2),
+            rng.uniform(42, 51, n // 4),
+            rng.uniform(85, 90, n // 16),
+            rng.uniform(-90, -85, n // 16),
+            rng.uniform(-20, 20, n - n // 2 - n // 4 - 2 * (n // 16)),
+        ]
+    )
+    lon = np.concatenate(
+        [
+            rng.normal(2.35, 0.08, n // 2),
+            rng.uniform(-4, 8, n // 4),
+            rng.uniform(-180, 180, 2 * (n // 16)),
+            rng.choice([-1, 1], n - n // 2 - n // 4 - 2 * (n // 16)) * rng.uniform(179, 180),
+        ]
+    )
+    return lat, lon
+
+
+QUERIES = [
+    (48.85, 2.35),
+    (45.76, 4.84),
+    (-33.9, 151.2),
+    (0.0, 179.95),
+    (0.0, -179.95),
+    (89.99, 10.0),
+    (-89.5, -170.0),
+    (70.0, -179.0),
+]
+
+
+def brute_force(lat, lon, rows, query):
+    d = distances(query[0], query[1], lat[rows], lon[rows])
+    return np.sort(d)
+
+
+@pytest.fixture(params=[None, 0.01, 0.5, 7.0], ids=lambda size: f"cell_size={size}")
+def index(request):
+    lat, lon = population(4000)
+    index = GridIndex(cell_size=request.param)
+    for row in range(len(lat)):
+        index.put(row, lat[row], lon[row])
+    return index, lat, lon
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("k", [1, 6, 50])
+def test_nearest_matches_brute_force(index, query, k):
+    index, lat, lon = index
+    got = index.nearest(*query, k)
+    expected = brute_force(lat, lon, np.arange(len(lat)), query)[:k]
+    np.testing.assert_allclose([d for _, d in got], expected)
+    rows = [row for row, _ in got]
+    np.testing.assert_allclose(distances(*query, lat[rows], lon[rows]), expected)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("radius", [0.5, 20, 300])
+def test_within_matches_brute_force(index, query, radius):
+    index, lat, lon = index
+    got = index.within(*query, radius)
+    expected = brute_force(lat, lon, np.arange(len(lat)), query)
+    np.testing.assert_allclose([d for _, d in got], expected[expected <= radius])
+
+
+def test_moves_and_removes_after_build():
+    lat, lon = population(4000, seed=1)
+    index = GridIndex()
+    for row in range(len(lat)):
+        index.put(row, lat[row], lon[row])
+    index.nearest(0, 0, 1)
+    rng = np.random.default_rng(2)
+    # Fewer updates than it takes to rebuild, then more
+    for n_moves in [50, 2000]:
+        for row in rng.choice(len(lat), n_moves, replace=False):
+            lat[row], lon[row] = rng.uniform(-90, 90), rng.uniform(-180, 180)
+            index.put(row, lat[row], lon[row])
+        removed = rng.choice(len(lat), 10, replace=False)
+        for row in removed:
+            index.remove(row)
+        kept = np.setdiff1d(np.arange(len(lat)), removed)
+        assert len(index) == len(kept)
+        for query in QUERIES:
+            expected = brute_force(lat, lon, kept, query)
+            got = index.nearest(*query, 6)
+            np.testing.assert_allclose([d for _, d in got], expected[:6])
+            assert not set(removed) & {row for row, _ in got}
+            got = index.within(*query, 100)
+            np.testing.assert_allclose([d for _, d in got], expected[expected <= 100])
+        for row in removed:
+            index.put(row, lat[row], lon[row])
+
+
+def test_empty_and_small_indexes():
+    index = GridIndex()
+    assert index.nearest(0, 0, 6) == []
+    assert index.within(0, 0, 100) == []
+    index.put(3, 10, 20)
+    assert [row for row, _ in index.nearest(0, 0, 6)] == [3]
+    assert index.within(10, 20, 1) == [(3, 0.0)]
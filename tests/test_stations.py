@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from stations import StationIndex, _csv_version
+
+
+def write_stops(path, names, lat, lon):
+    pd.DataFrame({"stop_name": names, "stop_lat": lat, "stop_lon": lon}).to_csv(path, index=False)
+
+
+def test_load_builds_the_index(tmp_path):
+    csv_path, index_dir = str(tmp_path / "stops.csv"), str(tmp_path / "index")
+    write_stops(csv_path, ["Châtelet", "Nation"], [48.858, 48.848], [2.347, 2.396])
+    stations = StationIndex.load(index_dir, csv_path)
+    assert stations.names == ["Châtelet", "Nation"]
+    assert stations.coords("Nation") == {"lat": 48.848, "lon": 2.396}
+
+
+def test_rebuild_keeps_mapped_index_intact(tmp_path):
+    csv_path, index_dir = str(tmp_path / "stops.csv"), str(tmp_path / "index")
+    write_stops(csv_path, ["Châtelet", "Nation"], [48.858, 48.848], [2.347, 2.396])
+    old = StationIndex.load(index_dir, csv_path)
+    write_stops(csv_path, ["Bastille"], [48.853], [2.369])
+    new = StationIndex.load(index_dir, csv_path)
+    assert new.names == ["Bastille"]
+    np.testing.assert_array_equal(old.lat, [48.858, 48.848])
+    # Without the stops table, the latest index is used
+    os.remove(csv_path)
+    assert StationIndex.load(index_dir, csv_path).names == ["Bastille"]
+
+
+def test_version_hashes_the_table_in_blocks(tmp_path):
+    csv_path = str(tmp_path / "stops.csv")
+    write_stops(csv_path, ["Châtelet", "Nation"], [48.858, 48.848], [2.347, 2.396])
+    with open(csv_path, "rb") as f:
+        expected = hashlib.sha256(f.read()).hexdigest()[:16]
+    assert _csv_version(csv_path) == expected
+    assert _csv_version(csv_path, block_size=7) == expected
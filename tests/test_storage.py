@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from distance import distances
+from storage import MatesStorage, SqliteStorage
+
+
+def random_mates(n, seed=0):
+    rng = np.random.default_rng(seed)
+    # Mostly around Paris, plus a few anywhere on earth
+    lat = np.concatenate([rng.normal(48.85, 0.1, n - 50), rng.uniform(-89, 89, 50)])
+    lon = np.concatenate([rng.normal(2.35, 0.15, n - 50), rng.uniform(-180, 180, 50)])
+    return [
+        {"key": f"mate {i}", "name": f"mate {i}", "location_name": "x", "lat": a, "lon": b}
+        for i, (a, b) in enumerate(zip(lat, lon))
+    ]
+
+
+@pytest.fixture(scope="module")
+def storage(tmp_path_factory):
+    storage = SqliteStorage(str(tmp_path_factory.mktemp("sqlite") / "mates.db"))
+    storage.bulk_put(random_mates(2000))
+    return storage
+
+
+def brute_force(mates, lat, lon):
+    d = distances(lat, lon, np.array([m["lat"] for m in mates]), np.array([m["lon"] for m in mates]))
+    return np.sort(d)
+
+
+@pytest.mark.parametrize(
+    "lat, lon",
+    [(48.85, 2.35), (40, 2.35), (-33.9, 151.2), (0, 179.9), (0, -179.9), (89.5, 0), (-89.9, 45)],
+)
+@pytest.mark.parametrize("k", [1, 6, 100])
+def test_nearest_matches_brute_force(storage, lat, lon, k):
+    nearest = storage.nearest(lat, lon, k)
+    expected = brute_force(list(storage.fetch_all()), lat, lon)[:k]
+    got = distances(lat, lon, np.array([m["lat"] for m in nearest]), np.array([m["lon"] for m in nearest]))
+    np.testing.assert_allclose(got, expected)
+
+
+def test_nearest_with_fewer_mates_than_k(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "mates.db"))
+    assert storage.nearest(48.85, 2.35, 6) == []
+    storage.bulk_put(random_mates(60))
+    assert len(storage.nearest(48.85, 2.35, 100)) == 60
+
+
+def test_within_matches_brute_force(storage):
+    within = storage.within(48.85, 2.35, 5)
+    expected = brute_force(list(storage.fetch_all()), 48.85, 2.35)
+    assert len(within) == (expected <= 5).sum()
+
+
+def test_put_updates_position(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "mates.db"))
+    storage.put({"name": "a", "location_name": "x", "lat": 48.85, "lon": 2.35}, key="a")
+    storage.put({"name": "a", "location_name": "y", "lat": -33.9, "lon": 151.2}, key="a")
+    assert storage.get("a")["location_name"] == "y"
+    assert storage.nearest(-33.9, 151.2, 1)[0]["key"] == "a"
+    assert storage.within(48.85, 2.35, 100) == []
+
+
+class DictStorage(MatesStorage):
+    def __init__(self):
+        self.mates = {}
+
+    def put(self, mate, key):
+        self.mates[key] = {**mate, "key": key}
+
+    def get(self, key):
+        return self.mates.get(key)
+
+    def fetch_all(self):
+        return iter(list(self.mates.values()))
+
+
+def test_backends_implement_put_get_and_fetch_all():
+    with pytest.raises(TypeError):
+        MatesStorage()
+
+    class NoFetchAll(MatesStorage):
+        put = DictStorage.put
+        get = DictStorage.get
+
+    with pytest.raises(TypeError, match="fetch_all"):
+        NoFetchAll()
+
+    # Everything else has a default built on them
+    storage = DictStorage()
+    mates = random_mates(200)
+    storage.bulk_put(mates)
+    nearest = storage.nearest(48.85, 2.35, 5)
+    expected = np.sort(distances(48.85, 2.35, *np.array([[m["lat"], m["lon"]] for m in mates]).T))
+    np.testing.assert_allclose(
+        distances(48.85, 2.35, *np.array([[m["lat"], m["lon"]] for m in nearest]).T), expected[:5]
+    )
+    assert len(storage.within(48.85, 2.35, expected[9])) == 10